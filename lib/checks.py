@@ -11,23 +11,57 @@ import socket
 import logging
 import requests
 import lib.config as config
-from time import sleep
+import lib.zpoolstat as zpoolstat
+import lib.mdb as mdb
+import lib.nettput as nettput
+import lib.sntp as sntp
+import lib.poolbench as poolbench
+import lib.kstat as kstat
+import lib.diskbench as diskbench
+import lib.devstats as devstats
+from time import sleep, monotonic
 from threading import Thread
 from lib.nefclient import NEFClient
-from lib.diskqual import r_seq
+from lib.diskqual import r_seq, r_seq_converge
+from lib.stats import summarize, median
 from queue import Queue, Empty
+from collections import OrderedDict
 from lib.execute import execute, RetcodeError, TimeoutError
+from lib.logs import Payload
+from lib.progress import Progress
 
 
 logger = logging.getLogger(__name__)
 
 
-def check_ping(ip):
+def local_only(f):
+    """
+    Mark a check as requiring local execution on the appliance, i.e. it runs
+    commands or reads devices rather than only talking to the NEF API. Such
+    checks can't be run remotely in fleet mode.
+    """
+    f.local_only = True
+    return f
+
+
+def disruptive(f):
+    """
+    Mark a check as disruptive, i.e. it moves services or loads the
+    appliance heavily. Such checks are never run by the monitoring daemon.
+    """
+    f.disruptive = True
+    return f
+
+
+@local_only
+def check_ping(ip, count=5):
     """
     Ping a remote ip/hostname.
 
     Args:
         ip (str): IP address or hostname
+    Kwargs:
+        count (int): Number of pings
     Returns:
         The check results.
     """
@@ -38,10 +72,11 @@ def check_ping(ip):
         "error": None
     }
 
-    cmd = "ping -n -s %s 56 5" % ip
+    cmd = "ping -n -s %s 56 %d" % (ip, count)
     try:
-        # If it take more then 10s to ping 5 times there is something wrong
-        output = execute(cmd, timeout=10)
+        # If it take more then 5s on top of the pings there is something
+        # wrong
+        output = execute(cmd, timeout=count + 5)
     except RetcodeError as r:
         logger.error("%s is not alive", ip)
         result["success"] = False
@@ -62,25 +97,29 @@ def check_ping(ip):
     return result
 
 
-def check_gateway_ping():
+@local_only
+def check_gateway_ping(count=5):
     """
     Check access and latency to the gateway server.
 
+    Kwargs:
+        count (int): Number of pings
     Returns:
         The check results.
     """
     gateway = config.get_gateway()
-    result = check_ping(gateway)
+    result = check_ping(gateway, count=count)
 
     return result
 
 
-def check_dns_ping():
+@local_only
+def check_dns_ping(count=5):
     """
     Check access and latency to each DNS server.
 
-    Args:
-        None
+    Kwargs:
+        count (int): Number of pings per server
     Returns:
         The check results.
     """
@@ -89,26 +128,28 @@ def check_dns_ping():
 
     # Ping each nameserver
     for n in nameservers:
-        results.append(check_ping(n))
+        results.append(check_ping(n, count=count))
 
     return results
 
 
-def check_domain_ping():
+@local_only
+def check_domain_ping(count=5):
     """
     Check access and latency to the current domain server.
 
-    Args:
-        None
+    Kwargs:
+        count (int): Number of pings
     Returns:
         The check results dict.
     """
     domain = config.get_domain()
-    result = check_ping(domain)
+    result = check_ping(domain, count=count)
 
     return result
 
 
+@local_only
 def check_cmd(cmd, timeout=None):
     """
     Check command return code.
@@ -130,7 +171,7 @@ def check_cmd(cmd, timeout=None):
         execute(cmd, timeout=timeout)
     except RetcodeError as r:
         logger.error("Failed with return code %s", r.retcode)
-        logger.debug(r.output)
+        logger.debug("%s", Payload(r.output))
         result["success"] = False
         result["error"] = r.output
     except TimeoutError as t:
@@ -141,6 +182,7 @@ def check_cmd(cmd, timeout=None):
     return result
 
 
+@local_only
 def check_dns_lookup(name):
     """
     Checks domain name resolution.
@@ -168,7 +210,31 @@ def check_dns_lookup(name):
     return result
 
 
-def _rsf_move(cluster, service, fromnode, tonode):
+def _fraction(percent):
+    """
+    Convert a job progress percentage to a fraction, None if not reported.
+    """
+    try:
+        return min(1.0, max(0.0, float(percent) / 100))
+    except (TypeError, ValueError):
+        return None
+
+
+def _rsf_move(cluster, service, fromnode, tonode, poll=10):
+    """
+    Move an RSF service and wait for the move to complete.
+
+    Args:
+        cluster (str): Cluster name
+        service (str): Service name
+        fromnode (str): Node running the service
+        tonode (str): Node to move the service to
+    Kwargs:
+        poll (float): Job status polling interval in seconds
+    Returns:
+        The move results including the seconds from submission to the
+        completion of the job, accurate to the polling interval.
+    """
     method = "rsf/clusters/%s/services/%s/move" % (cluster, service)
     payload = {
         "fromNode": fromnode,
@@ -177,12 +243,14 @@ def _rsf_move(cluster, service, fromnode, tonode):
     result = {
         "name": service,
         "success": True,
-        "error": None
+        "error": None,
+        "seconds": None
     }
 
     logger.info("Move cluster service '%s' to '%s'", service, tonode)
 
     nef = NEFClient()
+    start = monotonic()
     try:
         jobid = nef.post(method, payload=payload)
     except requests.exceptions.HTTPError as e:
@@ -192,24 +260,39 @@ def _rsf_move(cluster, service, fromnode, tonode):
         result["error"] = str(e)
     else:
         logger.info("Waiting for cluster service move to complete...")
+        progress = Progress("Move service '%s' to '%s'" % (service, tonode))
         try:
-            while not nef.jobstatus(jobid)[0]:
-                sleep(10)
+            while jobid is not None:
+                done, percent = nef.jobstatus(jobid)
+                if done:
+                    break
+                progress.update(fraction=_fraction(percent))
+                sleep(poll)
         except requests.exceptions.HTTPError as e:
             logger.error("Failed to move cluster service '%s'", service)
             logger.debug(str(e), exc_info=True)
             result["success"] = False
             result["error"] = str(e)
+        else:
+            result["seconds"] = round(monotonic() - start, 3)
+            logger.debug("Cluster service '%s' moved in %.3f second(s)",
+                         service, result["seconds"])
+        finally:
+            progress.close()
 
     return result
 
 
-def check_rsf_move(local=True):
+@local_only
+@disruptive
+def check_rsf_move(local=True, poll=10):
     """
     Check RSF service move.
 
     Args:
         local (bool): Move services local (True) or remote (False)
+    Kwargs:
+        poll (float): Job status polling interval in seconds
     Returns:
         The check results.
     """
@@ -227,12 +310,141 @@ def check_rsf_move(local=True):
 
     # Failover all services
     for service in services:
-        result = _rsf_move(cluster, service["serviceName"], fromnode, tonode)
+        result = _rsf_move(cluster, service["serviceName"], fromnode, tonode,
+                           poll=poll)
+        results.append(result)
+
+    return results
+
+
+@local_only
+@disruptive
+def check_rsf_failover(rounds=3, poll=0.25, max_seconds=None):
+    """
+    Benchmark RSF failover. Each service is moved to the partner and back
+    rounds times and every move is timed from submission to completion.
+
+    The services must be running on this node, i.e. after
+    check_rsf_move_to. The rounds of a service stop at its first failed
+    move.
+
+    Kwargs:
+        rounds (int): Round trips per service
+        poll (float): Job status polling interval in seconds
+        max_seconds (float): Maximum p95 move time in seconds
+    Returns:
+        The check results, one per service, with the p50, p95 and max move
+        times overall and per direction.
+    """
+    if rounds < 1:
+        return {
+            "success": False,
+            "error": "At least one failover round is required"
+        }
+
+    results = []
+    hostname = config.get_hostname()
+    cluster, partner, services = config.get_rsf()
+
+    for service in services:
+        name = service["serviceName"]
+        result = {
+            "name": name,
+            "success": True,
+            "error": None,
+            "moves": 0
+        }
+        times = {partner: [], hostname: []}
+
+        for i in range(rounds):
+            logger.info("Failover round %d/%d of cluster service '%s'",
+                        i + 1, rounds, name)
+            for fromnode, tonode in ((hostname, partner), (partner, hostname)):
+                move = _rsf_move(cluster, name, fromnode, tonode, poll=poll)
+                if not move["success"]:
+                    result["success"] = False
+                    result["error"] = move["error"]
+                    break
+                times[tonode].append(move["seconds"])
+                result["moves"] += 1
+            if not result["success"]:
+                break
+
+        result.update(summarize(times[partner] + times[hostname]))
+        result["to_partner"] = summarize(times[partner])
+        result["to_local"] = summarize(times[hostname])
+
+        if result["success"] and max_seconds is not None and \
+                result["p95"] is not None and result["p95"] > max_seconds:
+            result["success"] = False
+            result["error"] = "p95 failover time %.3f second(s) exceeds " \
+                "%s" % (result["p95"], max_seconds)
+        if result["error"] is not None:
+            logger.error("Cluster service '%s': %s", name, result["error"])
+        elif result["moves"]:
+            logger.info("Cluster service '%s' failover p50 %.3fs p95 %.3fs "
+                        "max %.3fs", name, result["p50"], result["p95"],
+                        result["max"])
         results.append(result)
 
     return results
 
 
+@local_only
+@disruptive
+def check_rsf_tput(host=None, port=nettput.PORT, streams=4, duration=5,
+                   min_gbps=None, max_stalls=None):
+    """
+    Check the network throughput to the RSF partner. The partner must be
+    running "autosac5 --tput-server".
+
+    Kwargs:
+        host (str): Server address, defaults to the RSF partner
+        port (int): Server port
+        streams (int): Number of parallel connections
+        duration (float): Test duration in seconds
+        min_gbps (float): Minimum aggregate throughput in Gbit/s
+        max_stalls (int): Maximum number of stalled sends
+    Returns:
+        The check results.
+    """
+    if host is None:
+        _, host, _ = config.get_rsf()
+
+    result = {
+        "host": host,
+        "success": True,
+        "error": None
+    }
+
+    logger.info("Measuring the throughput to %s", host)
+
+    try:
+        result.update(nettput.measure(host, port=port, streams=streams,
+                                      duration=duration))
+    except (OSError, RuntimeError) as e:
+        logger.error("Throughput test to %s failed", host)
+        logger.debug(str(e), exc_info=True)
+        result["success"] = False
+        result["error"] = str(e)
+        return result
+
+    logger.info("Throughput to %s is %s Gbit/s", host, result["gbps"])
+
+    if min_gbps is not None and result["gbps"] < min_gbps:
+        result["success"] = False
+        result["error"] = "Throughput %s Gbit/s is below %s Gbit/s" % \
+            (result["gbps"], min_gbps)
+    elif max_stalls is not None and result["stalls"] > max_stalls:
+        result["success"] = False
+        result["error"] = "%d stalled sends exceed %d" % \
+            (result["stalls"], max_stalls)
+    if result["error"] is not None:
+        logger.error(result["error"])
+
+    return result
+
+
 def check_zpool_status():
     """
     Check zpool status and confirm all pools are ONLINE.
@@ -260,6 +472,297 @@ def check_zpool_status():
     return results
 
 
+@local_only
+def check_scan(window=10, min_rate=None, source=zpoolstat.status):
+    """
+    Measure the rate of running scrubs and resilvers over a window and
+    estimate their time to completion.
+
+    Args:
+        None
+    Kwargs:
+        window (float): Seconds between the two samples of the scan progress
+        min_rate (float): Minimum scan rate in MB/s
+        source (function): Returns the 'zpool status' output lines
+    Returns:
+        The check results, one per pool.
+    """
+    results = []
+
+    def snapshot():
+        return monotonic(), OrderedDict(
+            (s["pool"], s) for s in zpoolstat.parse_scan(source()))
+
+    try:
+        t1, first = snapshot()
+        # Only wait if there is something to measure
+        if any(s["state"] == "in progress" for s in first.values()):
+            sleep(window)
+            t2, second = snapshot()
+        else:
+            t2, second = t1, first
+    except RetcodeError as r:
+        logger.error("Failed to get the pool status")
+        logger.debug("%s", Payload(r.output))
+        return {
+            "success": False,
+            "error": r.output
+        }
+
+    for pool, scan in second.items():
+        result = {
+            "pool": pool,
+            "success": True,
+            "error": None,
+            "function": scan["function"],
+            "state": scan["state"],
+            "percent": scan["percent"],
+            "rate": None,
+            "eta": None
+        }
+        before = first.get(pool)
+        running = scan["state"] == "in progress" and before is not None and \
+            before["state"] == "in progress" and t2 > t1 and \
+            None not in (scan["examined"], before["examined"])
+
+        if running:
+            rate = (scan["examined"] - before["examined"]) / (t2 - t1)
+            result["rate"] = round(rate / 1024 ** 2, 3)
+            if rate > 0 and scan["total"] is not None:
+                result["eta"] = round(
+                    max(0, scan["total"] - scan["examined"]) / rate)
+            logger.info("Pool '%s' %s at %s MB/s, %s%% done", pool,
+                        scan["function"], result["rate"], scan["percent"])
+            if min_rate is not None and result["rate"] < min_rate:
+                result["success"] = False
+                result["error"] = "The %s of pool '%s' runs at %s MB/s, " \
+                    "below %s MB/s" % (scan["function"], pool,
+                                       result["rate"], min_rate)
+                logger.error(result["error"])
+        results.append(result)
+
+    return results
+
+
+def _ratio(hits, misses):
+    """
+    Return the hit ratio or None if there were no accesses.
+    """
+    if hits + misses <= 0:
+        return None
+
+    return round(hits / float(hits + misses), 4)
+
+
+@local_only
+def check_arc(window=10, samples=2, min_hit_ratio=None,
+              min_l2_hit_ratio=None, max_throttles=0, reader=kstat.arcstats):
+    """
+    Sample the ARC and L2ARC statistics over a window and compute the hit
+    ratios, eviction and L2ARC feed rates and memory pressure from the
+    deltas.
+
+    Args:
+        None
+    Kwargs:
+        window (float): Seconds between the first and last snapshot
+        samples (int): Number of snapshots, at least 2
+        min_hit_ratio (float): Minimum ARC hit ratio, 0 to 1
+        min_l2_hit_ratio (float): Minimum L2ARC hit ratio, 0 to 1
+        max_throttles (int): Maximum number of writes throttled because of
+                             memory pressure
+        reader (function): Returns the arcstats as a dict
+    Returns:
+        The check results.
+    """
+    result = {
+        "success": True,
+        "error": None
+    }
+    errors = []
+
+    snapshots = []
+    try:
+        for i in range(max(2, samples)):
+            if i:
+                sleep(window / float(max(2, samples) - 1))
+            snapshots.append((monotonic(), reader()))
+    except (RetcodeError, TimeoutError, IOError, OSError) as e:
+        logger.error("Failed to read the ARC statistics")
+        logger.debug(str(e), exc_info=True)
+        result["success"] = False
+        result["error"] = getattr(e, "output", None) or str(e)
+        return result
+
+    (t1, first), (t2, last) = snapshots[0], snapshots[-1]
+    seconds = t2 - t1
+
+    def delta(name):
+        return last.get(name, 0) - first.get(name, 0)
+
+    def rate(*names):
+        return round(sum(delta(n) for n in names) / seconds / 1024 ** 2,
+                     3)
+
+    result.update({
+        "seconds": round(seconds, 3),
+        "size": last.get("size"),
+        "target": last.get("c"),
+        "max_size": last.get("c_max"),
+        "hit_ratio": _ratio(delta("hits"), delta("misses")),
+        "demand_hit_ratio": _ratio(delta("demand_data_hits"),
+                                   delta("demand_data_misses")),
+        "evict_rate": rate("evict_l2_eligible", "evict_l2_ineligible"),
+        "throttles": delta("memory_throttle_count"),
+        "l2_size": last.get("l2_size", 0),
+        "l2_hit_ratio": _ratio(delta("l2_hits"), delta("l2_misses")),
+        "l2_feed_rate": rate("l2_write_bytes"),
+        "l2_errors": delta("l2_io_error") + delta("l2_cksum_bad") +
+        delta("l2_writes_error")
+    })
+
+    # The target shrinking to its minimum means the kernel reclaims memory
+    c_min = last.get("c_min")
+    result["pressure"] = bool(result["throttles"]) or (
+        c_min is not None and result["target"] is not None and
+        result["target"] <= c_min)
+
+    logger.debug("ARC hit ratio %s, L2ARC hit ratio %s",
+                 result["hit_ratio"], result["l2_hit_ratio"])
+
+    if min_hit_ratio is not None and result["hit_ratio"] is not None and \
+            result["hit_ratio"] < min_hit_ratio:
+        errors.append("ARC hit ratio %s is below %s" %
+                      (result["hit_ratio"], min_hit_ratio))
+    if min_l2_hit_ratio is not None and result["l2_size"] and \
+            result["l2_hit_ratio"] is not None and \
+            result["l2_hit_ratio"] < min_l2_hit_ratio:
+        errors.append("L2ARC hit ratio %s is below %s" %
+                      (result["l2_hit_ratio"], min_l2_hit_ratio))
+    if max_throttles is not None and result["throttles"] > max_throttles:
+        errors.append("%d writes were throttled by memory pressure" %
+                      result["throttles"])
+    if result["l2_errors"] > 0:
+        errors.append("%d L2ARC device errors" % result["l2_errors"])
+
+    if errors:
+        result["success"] = False
+        result["error"] = "; ".join(errors)
+        logger.error(result["error"])
+
+    return result
+
+
+@local_only
+def check_vdev_iostat(interval=1, samples=10, latency=True, imbalance=2.0,
+                      min_latency=1.0, min_ops=10, max_latency=None,
+                      source=zpoolstat.iostat):
+    """
+    Sample per-vdev I/O statistics of all pools over a window and flag
+    imbalanced or slow vdevs.
+
+    A leaf vdev is imbalanced if its median latency is more than imbalance
+    times the median of its peers, or, without latency statistics, if its
+    median operations per second deviate from its peers by that factor.
+
+    Args:
+        interval (int): Sample interval in seconds
+        samples (int): Number of samples
+        latency (bool): Collect latency statistics
+        imbalance (float): Allowed ratio between a vdev and its peers
+        min_latency (float): Latency in ms below which vdevs aren't flagged
+        min_ops (float): Peer ops/s below which vdevs aren't flagged
+        max_latency (float): Optional p95 latency limit in ms
+        source (function): Returns the 'zpool iostat -v' output lines
+    Returns:
+        The check results.
+    """
+    results = []
+    pools = [p["poolName"] for p in config.get_pools()]
+
+    # The first report is skipped because it contains the averages since boot
+    lines = source(pools, interval, samples + 1, latency=latency)
+    data = zpoolstat.sample(lines)
+
+    # Leaf vdevs grouped by their parent vdev
+    parents = set(v.rsplit("/", 1)[0] for v in data if "/" in v)
+    peers = {}
+    for vdev in data:
+        if "/" not in vdev or vdev in parents:
+            continue
+        peers.setdefault(vdev.rsplit("/", 1)[0], []).append(vdev)
+
+    # Median of each statistic per vdev
+    medians = {}
+    for vdev, fields in data.items():
+        medians[vdev] = dict((f, median(fields[f])) for f in fields)
+        medians[vdev]["ops"] = median([r + w for r, w in
+                                       zip(fields["read_ops"],
+                                           fields["write_ops"])])
+
+    flagged = {}
+    for parent, vdevs in peers.items():
+        for vdev in vdevs:
+            others = [v for v in vdevs if v != vdev]
+            reasons = []
+
+            for f in ("read_lat", "write_lat"):
+                value = medians[vdev][f]
+                base = median([medians[v][f] for v in others
+                               if medians[v][f] is not None])
+                if value is None or value < min_latency:
+                    continue
+                if base is not None and value > imbalance * base:
+                    reasons.append("%s %.2fms is %.1fx its peers" %
+                                   (f, value, value / max(base, 1e-9)))
+                p95 = summarize(data[vdev][f])["p95"]
+                if max_latency is not None and p95 > max_latency:
+                    reasons.append("%s p95 %.2fms exceeds %.2fms" %
+                                   (f, p95, max_latency))
+
+            # Fall back to the operations without latency statistics
+            if not latency and others:
+                value = medians[vdev]["ops"]
+                base = median([medians[v]["ops"] for v in others
+                               if medians[v]["ops"] is not None])
+                if value is not None and base is not None and \
+                        base >= min_ops and \
+                        not base / imbalance <= value <= base * imbalance:
+                    reasons.append("%.0f ops/s against %.0f ops/s for its "
+                                   "peers" % (value, base))
+
+            if reasons:
+                logger.error("vdev '%s' is slow: %s", vdev,
+                             "; ".join(reasons))
+                flagged[vdev] = reasons
+
+    for pool in pools:
+        result = {
+            "pool": pool,
+            "success": True,
+            "error": None,
+            "vdevs": {},
+            "flagged": {}
+        }
+        for vdev, fields in data.items():
+            if vdev != pool and not vdev.startswith(pool + "/"):
+                continue
+            result["vdevs"][vdev] = dict((f, summarize(v))
+                                         for f, v in fields.items() if v)
+            if vdev in flagged:
+                result["flagged"][vdev] = flagged[vdev]
+        if not result["vdevs"]:
+            result["success"] = False
+            result["error"] = "No samples collected"
+        elif result["flagged"]:
+            result["success"] = False
+            result["error"] = "%d vdev(s) are imbalanced or slow" % \
+                len(result["flagged"])
+        results.append(result)
+
+    return results
+
+
 def check_post(method, payload=None):
     """
     Check API POST request return code.
@@ -298,18 +801,144 @@ def check_post(method, payload=None):
     return result
 
 
-def check_disk_perf(bs=32, duration=5, workers=8):
+def _device_stats(source, disks):
+    """
+    Read the device counters, None if they are not available.
+    """
+    try:
+        return source(disks)
+    except (RetcodeError, TimeoutError, IOError, OSError) as e:
+        logger.warning("Device statistics are not available")
+        logger.debug(str(e), exc_info=True)
+        return None
+
+
+def _device_deltas(results, before, source, max_asvc_t, max_svc_ratio):
+    """
+    Add the device counter deltas to the check_disk_perf results and fail
+    the disks which logged errors or were slow to service I/O.
+    """
+    if before is None:
+        return results
+    after = _device_stats(source, [r["disk"] for r in results])
+    if after is None:
+        return results
+
+    for result in results:
+        disk = result["disk"]
+        if disk not in before or disk not in after:
+            continue
+        d = devstats.delta(before[disk], after[disk])
+        d["baseline_asvc_t"] = devstats.baseline(before[disk])
+        result["device"] = d
+
+        problems = []
+        errors = sum(d["errors"][k] for k in devstats.TOTALS)
+        if errors > 0:
+            problems.append("%d device errors during the test (%s)" % (
+                errors, ", ".join("%s %d" % (k, d["errors"][k])
+                                  for k in devstats.TOTALS
+                                  if d["errors"][k])))
+        if d["asvc_t"] is not None:
+            if max_asvc_t is not None and d["asvc_t"] > max_asvc_t:
+                problems.append("average service time %.3f ms exceeds "
+                                "%s ms" % (d["asvc_t"], max_asvc_t))
+            if max_svc_ratio is not None and d["baseline_asvc_t"] and \
+                    d["asvc_t"] > max_svc_ratio * d["baseline_asvc_t"]:
+                problems.append("average service time rose from %.3f to "
+                                "%.3f ms" % (d["baseline_asvc_t"],
+                                             d["asvc_t"]))
+
+        if problems:
+            logger.error("%s %s", disk, "; ".join(problems))
+            result["success"] = False
+            result["error"] = "; ".join(
+                ([result["error"]] if result["error"] else []) + problems)
+
+    return results
+
+
+def _disk_perf_native(disks, bs, duration, workers, engine, progress):
+    """
+    Run check_disk_perf with an in-process engine.
+    """
+    results = []
+
+    def done(disk, stats, error):
+        progress.advance(rate=stats["tput"] if stats else None)
+
+    for disk, stats, error in diskbench.run(disks, bs * 1024, duration,
+                                            workers=workers, engine=engine,
+                                            callback=done):
+        result = {
+            "disk": disk,
+            "success": error is None,
+            "error": error
+        }
+        if stats is not None:
+            logger.debug("%s performance is %s MB/s", disk, stats["tput"])
+            result.update(stats)
+        results.append(result)
+
+    return results
+
+
+@local_only
+@disruptive
+def check_disk_perf(bs=32, duration=5, workers=8, precision=None,
+                    confidence=0.95, interval=1, min_duration=2,
+                    max_duration=30, disks=None, engine="dd",
+                    device_stats=True, max_asvc_t=None, max_svc_ratio=None,
+                    stats_source=devstats.snapshot):
     """
     Verifies disk performance.
 
+    If a precision is defined each disk is sampled every interval and
+    stopped as soon as its throughput is known within that precision, or
+    after max_duration, rather than running for a fixed duration.
+
+    The "dd" engine runs dd for every disk. The "thread" and "process"
+    engines read the disks in-process and also report the read latency,
+    the process engine spreads the disks over a pool of worker processes
+    to drive large shelves. They always run for the fixed duration.
+
+    The device error and service time counters of all disks are read before
+    and after the benchmark. A disk fails if it logged errors meanwhile or
+    its average active service time exceeds the limits.
+
     Args:
-        bs       (int): Blocksize in KB
-        duration (int): Duration in seconds
-        workers  (int): Number of threads
+        bs           (int): Blocksize in KB
+        duration     (int): Duration in seconds
+        workers      (int): Number of threads
+        precision    (float): Relative confidence interval half-width to
+                              stop at, i.e. 0.05 for +/- 5%
+        confidence   (float): Confidence level, 0.90, 0.95 or 0.99
+        interval     (float): Sample interval in seconds
+        min_duration (float): Minimum duration per disk in seconds
+        max_duration (float): Maximum duration per disk in seconds
+        disks        (list): Logical devices to test, defaults to all disks
+        engine       (str): "dd", "thread" or "process"
+        device_stats (bool): Record the device counter deltas
+        max_asvc_t   (float): Maximum average active service time in ms
+        max_svc_ratio (float): Maximum ratio of the average active service
+                               time to its average since boot
+        stats_source (function): Returns the device counters keyed by disk
     Returns:
         The check results
     """
-    disks = config.get_disks()
+    if disks is None:
+        disks = [d["logicalDevice"] for d in config.get_disks()]
+
+    before = _device_stats(stats_source, disks) if device_stats else None
+    progress = Progress("Disk performance", total=len(disks), unit="disks")
+
+    if engine != "dd":
+        with progress:
+            results = _disk_perf_native(disks, bs, duration, workers, engine,
+                                        progress)
+        return _device_deltas(results, before, stats_source, max_asvc_t,
+                              max_svc_ratio)
+
     resultsq = Queue()
     results = []
 
@@ -330,10 +959,19 @@ def check_disk_perf(bs=32, duration=5, workers=8):
 
             # Do something with disk
             try:
-                tput = r_seq(disk, bs, duration)
+                if precision is None:
+                    tput = r_seq(disk, bs, duration)
+                else:
+                    stats = r_seq_converge(disk, bs, interval=interval,
+                                           min_duration=min_duration,
+                                           max_duration=max_duration,
+                                           precision=precision,
+                                           confidence=confidence)
+                    tput = stats.pop("tput")
+                    result.update(stats)
             except RetcodeError as r:
                 logger.error(str(r))
-                logger.debug(r.output)
+                logger.debug("%s", Payload(r.output))
                 result["success"] = False
                 result["error"] = r.output
             # We don't want any unhandled exceptions while threading to we
@@ -349,10 +987,11 @@ def check_disk_perf(bs=32, duration=5, workers=8):
                 result["tput"] = tput
             finally:
                 resultsq.put(result)
+                progress.advance(rate=result.get("tput"))
 
     # Build queue
     diskq = Queue()
-    [diskq.put(d["logicalDevice"]) for d in disks]
+    [diskq.put(d) for d in disks]
 
     # Start threads
     thrs = []
@@ -364,6 +1003,7 @@ def check_disk_perf(bs=32, duration=5, workers=8):
     # Join threads
     for t in thrs:
         t.join()
+    progress.close()
 
     # Build check dict from results
     while True:
@@ -372,43 +1012,258 @@ def check_disk_perf(bs=32, duration=5, workers=8):
         except Empty:
             break
 
-    return results
+    return _device_deltas(results, before, stats_source, max_asvc_t,
+                          max_svc_ratio)
 
 
-def check_metadata_blocks():
+@local_only
+def check_time_delta(servers=None, max_offset=1.0, samples=4, timeout=2,
+                     port=123, domain=True):
     """
-    Verifies zfs_default_ibs is set to 14 (decimal) ; see NEX-15280
+    Check the clock offset to the NTP servers and the domain controller.
 
     Args:
         None
+    Kwargs:
+        servers (list): NTP servers, defaults to the servers of the NTP
+                        daemon config
+        max_offset (float): Maximum absolute offset in seconds
+        samples (int): Requests per server
+        timeout (float): Response timeout per request in seconds
+        port (int): NTP port
+        domain (bool): Also check the domain controller
     Returns:
-        The check results
+        The check results, one per server.
     """
-    result = {
-        "success": True,
-        "error": None
-    }
+    results = []
 
-    cmd = "echo 'zfs_default_ibs/D' | mdb -k"
-    try:
-        output = execute(cmd, timeout=10)
-    except RetcodeError as r:
-        logger.error("could not execute mdb command")
-        result["success"] = False
-        result["error"] = r.output
-    except TimeoutError as t:
-        logger.error(str(t))
-        result["success"] = False
-        result["error"] = str(t)
+    if servers is None:
+        try:
+            servers = config.get_ntp_servers()
+        except RuntimeError as r:
+            logger.warning(str(r))
+            servers = []
+    servers = list(servers)
+    if domain:
+        try:
+            dc = config.get_domain()
+        except RuntimeError as r:
+            logger.debug(str(r))
+        else:
+            if dc not in servers:
+                servers.append(dc)
+
+    if not servers:
+        return {
+            "success": False,
+            "error": "No NTP servers or domain controller to check against"
+        }
+
+    sampled = sntp.sample_all(servers, samples=samples, port=port,
+                              timeout=timeout)
+
+    for server in servers:
+        s = sampled[server]
+        if isinstance(s, Exception):
+            logger.error("Failed to query %s", server)
+            results.append({
+                "server": server,
+                "success": False,
+                "error": str(s)
+            })
+            continue
+
+        result = {
+            "success": True,
+            "error": None
+        }
+        result.update(s)
+        logger.debug("%s offset %.6f delay %.6f jitter %.6f", server,
+                     s["offset"], s["delay"], s["jitter"])
+        if abs(s["offset"]) > max_offset:
+            result["success"] = False
+            result["error"] = "The clock is off by %.3f second(s)" % \
+                s["offset"]
+            logger.error("The clock is off by %.3f second(s) from %s",
+                         s["offset"], server)
+        results.append(result)
+
+    return results
+
+
+@local_only
+@disruptive
+def check_pool_write(pools=None, directory=None, recordsizes=("128K",),
+                     block_sizes=(4, 128), patterns=("seq", "rand"),
+                     syncs=("dsync", "none"), size=256, duration=10,
+                     min_mbps=None):
+    """
+    Benchmark writes through the file system. A temporary dataset is created
+    in each pool for every recordsize, or a temporary directory is used, and
+    every combination of block size, pattern and sync mode is written.
+
+    Kwargs:
+        pools (list): Pools to benchmark, defaults to all pools
+        directory (str): Benchmark in this directory rather than in datasets,
+                         the recordsizes are ignored
+        recordsizes (list): Dataset recordsizes, i.e. "128K"
+        block_sizes (list): Write sizes in KB
+        patterns (list): "seq" and/or "rand"
+        syncs (list): "dsync" (O_DSYNC), "fsync" (per write) and/or "none"
+        size (int): Maximum MB written per combination
+        duration (float): Maximum seconds per combination
+        min_mbps (float): Minimum throughput in MB/s
+    Returns:
+        The check results, one per combination.
+    """
+    results = []
+
+    if directory is not None:
+        targets = [(directory, None, None)]
     else:
-        # verify that the value is 14
-        entry = output.split("\n")[1]
-        value = int(entry.split(":")[1])
-        if value != 14:
-            logger.error("zfs_default_ibs is not 14! %s" % entry)
+        if pools is None:
+            pools = [p["poolName"] for p in config.get_pools()]
+        targets = [(p, p, rs) for p in pools for rs in recordsizes]
+
+    for label, pool, recordsize in targets:
+        if pool is None:
+            workspace = poolbench.directory(directory)
+        else:
+            label = "%s/%s" % (pool, recordsize)
+            workspace = poolbench.dataset(pool, recordsize=recordsize)
+
+        logger.info("Benchmarking writes to %s", label)
+
+        try:
+            with workspace as path:
+                for bs, pattern, sync, stats in poolbench.sweep(
+                        path, [b * 1024 for b in block_sizes],
+                        patterns=patterns, syncs=syncs,
+                        size=size * 1024 * 1024, duration=duration):
+                    result = {
+                        "name": "%s %s %s %dK" % (label, pattern, sync,
+                                                  bs // 1024),
+                        "success": True,
+                        "error": None
+                    }
+                    result.update(stats)
+                    logger.debug("%s %s MB/s p95 %s ms", result["name"],
+                                 stats["mbps"], stats["p95"])
+                    if min_mbps is not None and stats["mbps"] < min_mbps:
+                        result["success"] = False
+                        result["error"] = "%s MB/s is below %s MB/s" % \
+                            (stats["mbps"], min_mbps)
+                        logger.error("%s: %s", result["name"],
+                                     result["error"])
+                    results.append(result)
+        except (RetcodeError, TimeoutError, OSError, ValueError) as e:
+            logger.error("Write benchmark of %s failed", label)
+            logger.debug(str(e), exc_info=True)
+            results.append({
+                "name": label,
+                "success": False,
+                "error": getattr(e, "output", None) or str(e)
+            })
+
+    return results
+
+
+@local_only
+def check_tunables(tunables, timeout=10, reader=mdb.read):
+    """
+    Verify kernel tunables. All tunables are read in a single debugger
+    session and each mismatch is reported separately.
+
+    e.g.
+    [
+        {
+            "symbol": "zfs_default_ibs",
+            "format": "D",
+            "expected": 14
+        },
+        {
+            "symbol": "zfs_arc_max",
+            "format": "J",
+            "min": 1073741824
+        }
+    ]
+
+    Args:
+        tunables (list): Tunables, each with a symbol, an mdb format
+                         (default "D") and an expected value and/or a min
+                         and max, which require a numeric format
+    Kwargs:
+        timeout (int): Debugger timeout in seconds
+        reader (function): Called with a list of (symbol, format) tuples and
+                           the timeout, returns the values keyed by symbol
+    Returns:
+        The check results, one per tunable.
+    """
+    results = []
+    variables = [(t["symbol"], t.get("format", "D")) for t in tunables]
+
+    try:
+        values = reader(variables, timeout=timeout)
+    except (RetcodeError, TimeoutError) as e:
+        logger.error("Failed to read the kernel tunables")
+        logger.error(str(e))
+        error = getattr(e, "output", None) or str(e)
+        return [{"name": t["symbol"], "success": False, "error": error}
+                for t in tunables]
+
+    for t in tunables:
+        symbol = t["symbol"]
+        result = {
+            "name": symbol,
+            "success": True,
+            "error": None,
+            "value": values.get(symbol)
+        }
+        for k in ("expected", "min", "max"):
+            if k in t:
+                result[k] = t[k]
+
+        value = result["value"]
+        if symbol not in values:
+            result["error"] = "%s could not be read" % symbol
+        elif "expected" in t and value != t["expected"]:
+            result["error"] = "%s is %s, expected %s" % \
+                (symbol, value, t["expected"])
+        elif ("min" in t or "max" in t) and \
+                not isinstance(value, (int, float)):
+            # min and max need a decimal or hexadecimal format
+            result["error"] = "%s is %r, not a number to compare with the " \
+                "min or max" % (symbol, value)
+        elif "min" in t and value < t["min"]:
+            result["error"] = "%s is %s, below %s" % (symbol, value, t["min"])
+        elif "max" in t and value > t["max"]:
+            result["error"] = "%s is %s, above %s" % (symbol, value, t["max"])
+
+        if result["error"] is not None:
+            logger.error(result["error"])
             result["success"] = False
-            result["error"] = entry
+        results.append(result)
 
+    return results
 
-    return result
 
+@local_only
+def check_metadata_blocks():
+    """
+    Verifies zfs_default_ibs is set to 14 (decimal) ; see NEX-15280
+
+    Args:
+        None
+    Returns:
+        The check results
+    """
+    result = check_tunables([{
+        "symbol": "zfs_default_ibs",
+        "format": "D",
+        "expected": 14
+    }])[0]
+
+    return {
+        "success": result["success"],
+        "error": result["error"]
+    }
@@ -7,14 +7,66 @@ Copyright (c) 2016  Nexenta Systems
 William Kettler <william.kettler@nexenta.com>
 """
 
+import time
 import socket
 import logging
+import threading
+import lib.nefclient as nefclient
+from functools import wraps
 from lib.nefclient import NEFClient
 
 
 logger = logging.getLogger(__name__)
 
+# Seconds the static appliance configuration is cached for, 0 disables the
+# cache. Long running processes, i.e. the daemon, enable it. The disks, pools
+# and cluster services carry health and state and are always fetched.
+cache_ttl = 0
 
+# NTP daemon configuration files in order of preference
+NTP_CONF = ["/etc/inet/ntp.conf", "/etc/ntp.conf"]
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _cached(f):
+    """
+    Cache the return value of a configuration function for cache_ttl seconds.
+
+    Entries are kept per NEF endpoint so fleet workers never see another
+    appliance's configuration.
+    """
+    @wraps(f)
+    def wrapper():
+        if not cache_ttl:
+            return f()
+
+        key = (f.__name__, nefclient.defaults["url"])
+        with _cache_lock:
+            entry = _cache.get(key)
+        if entry is not None and time.time() - entry[0] < cache_ttl:
+            logger.debug("Using cached %s", f.__name__)
+            return entry[1]
+
+        value = f()
+        with _cache_lock:
+            _cache[key] = (time.time(), value)
+
+        return value
+
+    return wrapper
+
+
+def clear_cache():
+    """
+    Discard the cached configuration.
+    """
+    with _cache_lock:
+        _cache.clear()
+
+
+@_cached
 def get_hostname():
     """
     Return the system hostname.
@@ -35,6 +87,7 @@ def get_hostname():
     return hostname
 
 
+@_cached
 def get_gateway():
     """
     Return the default network gateway.
@@ -65,6 +118,7 @@ def get_gateway():
     return gateway
 
 
+@_cached
 def get_nameservers():
     """
     Return a list of configured DNS servers.
@@ -94,6 +148,7 @@ def get_nameservers():
     return nameservers
 
 
+@_cached
 def get_domain():
     """
     Return the domain configuration.
@@ -125,6 +180,41 @@ def get_domain():
     return dc
 
 
+@_cached
+def get_ntp_servers():
+    """
+    Return the NTP servers configured for the NTP daemon.
+
+    Args:
+        None
+    Returns:
+        A list of NTP servers.
+    """
+    servers = []
+
+    for path in NTP_CONF:
+        try:
+            with open(path) as fh:
+                lines = fh.readlines()
+        except IOError:
+            continue
+        for line in lines:
+            fields = line.split()
+            if len(fields) < 2 or fields[0] not in ("server", "pool"):
+                continue
+            # 127.127.x.x are reference clock drivers, i.e. the local clock
+            if fields[1].startswith("127.127."):
+                continue
+            logger.debug("NTP server %s", fields[1])
+            servers.append(fields[1])
+        break
+
+    if not servers:
+        raise RuntimeError("No NTP servers configured")
+
+    return servers
+
+
 def get_rsf():
     """
     Return the RSF configuration.
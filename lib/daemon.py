@@ -0,0 +1,105 @@
+"""
+daemon.py
+
+Continuously run the lightweight checks between acceptance runs.
+
+Every enabled check with an "interval" (seconds) in the config is run on its
+own schedule with random jitter so checks don't synchronize. Disruptive
+checks are never run. The static configuration from NEF, i.e. the hostname
+and name servers, is cached and the NEF connections are kept open between
+runs.
+
+Copyright (c) 2016  Nexenta Systems
+William Kettler <william.kettler@nexenta.com>
+"""
+
+import time
+import heapq
+import random
+import logging
+import lib.config as config
+from lib.metrics import Exporter
+from lib.runner import get_check, run_check
+
+
+logger = logging.getLogger(__name__)
+
+
+def schedule(checks):
+    """
+    Return the checks the daemon runs.
+
+    Args:
+        checks (list): Configured checks
+    Returns:
+        A list of (check, interval, jitter) tuples.
+    """
+    scheduled = []
+
+    for c in checks:
+        if not c["enabled"] or not c.get("interval"):
+            continue
+        try:
+            f = get_check(c)
+        except RuntimeError as r:
+            logger.error(str(r))
+            continue
+        if getattr(f, "disruptive", False):
+            logger.warning("Check %s is disruptive and won't be scheduled",
+                           c["name"].upper())
+            continue
+
+        interval = float(c["interval"])
+        jitter = float(c.get("jitter", interval / 10.0))
+        scheduled.append((c, interval, jitter))
+
+    return scheduled
+
+
+def run(checks, textfile=None, listen=None, cache_ttl=300):
+    """
+    Run the scheduled checks forever.
+
+    Args:
+        checks (list): Configured checks
+    Kwargs:
+        textfile (str): Path of the Prometheus metrics file
+        listen (tuple): (host, port) to serve the metrics on
+        cache_ttl (int): Seconds the static NEF configuration is cached for
+    """
+    scheduled = schedule(checks)
+    if not scheduled:
+        raise RuntimeError("No checks with an interval are enabled")
+
+    config.cache_ttl = cache_ttl
+    exporter = Exporter(textfile=textfile, listen=listen)
+
+    # Spread the first runs over the jitter window
+    now = time.time()
+    queue = [(now + random.uniform(0, j), i)
+             for i, (_, _, j) in enumerate(scheduled)]
+    heapq.heapify(queue)
+
+    logger.info("Monitoring %d check(s)", len(scheduled))
+
+    try:
+        while True:
+            due, i = heapq.heappop(queue)
+            c, interval, jitter = scheduled[i]
+
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+            start = time.time()
+            output = run_check(c)
+            end = time.time()
+            exporter.update(c["name"], output["result"], end - start, end)
+
+            # Don't accumulate a backlog if a check ran longer than its
+            # interval
+            due = max(due + interval + random.uniform(-jitter, jitter),
+                      end + jitter)
+            heapq.heappush(queue, (due, i))
+    finally:
+        exporter.close()
@@ -0,0 +1,198 @@
+"""
+devstats.py
+
+Per-disk I/O and error counters.
+
+The extended device statistics iostat reports are read from the disk and
+device_error kstats of all disks at once. The kstats are named after the
+driver instance, i.e. sd12, which is found by resolving the /dev/rdsk link
+of the disk to its physical path and looking it up in /etc/path_to_inst.
+
+Copyright (c) 2016  Nexenta Systems
+William Kettler <william.kettler@nexenta.com>
+"""
+
+import os
+import re
+import logging
+import lib.kstat as kstat
+from lib.execute import execute
+
+
+logger = logging.getLogger(__name__)
+
+PATH_TO_INST = "/etc/path_to_inst"
+
+# "physical path" instance "driver"
+INSTANCE = re.compile(r'^"([^"]+)"\s+(\d+)\s+"([^"]+)"')
+
+# device_error statistics reported as error counters
+ERRORS = (
+    ("hard", "Hard Errors"),
+    ("soft", "Soft Errors"),
+    ("transport", "Transport Errors"),
+    ("media", "Media Error"),
+    ("not_ready", "Device Not Ready"),
+    ("no_device", "No Device"),
+    ("recoverable", "Recoverable"),
+    ("illegal_request", "Illegal Request"),
+    ("pfa", "Predictive Failure Analysis")
+)
+
+# Errors failing a disk, the others are subsets of these
+TOTALS = ("hard", "soft", "transport")
+
+# disk statistics kept, the times are in ns
+IO = ("reads", "writes", "nread", "nwritten", "rtime", "wtime", "rlentime",
+      "wlentime")
+
+
+def instances(path=PATH_TO_INST):
+    """
+    Read the driver instances.
+
+    Kwargs:
+        path (str): path_to_inst file
+    Returns:
+        A dict of kstat names, i.e. "sd12", keyed by physical path.
+    """
+    names = {}
+
+    with open(path) as fh:
+        for line in fh:
+            m = INSTANCE.match(line)
+            if m is not None:
+                names[m.group(1)] = "%s%s" % (m.group(3), m.group(2))
+
+    return names
+
+
+def kstat_names(disks, insts=None):
+    """
+    Map disks to the kstat names of their driver instances.
+
+    Args:
+        disks (list): Logical device names
+    Kwargs:
+        insts (dict): Driver instances as returned by instances()
+    Returns:
+        A dict of kstat names keyed by disk, unresolved disks are left out.
+    """
+    if insts is None:
+        insts = instances()
+    names = {}
+
+    for disk in disks:
+        # i.e. /devices/scsi_vhci/disk@g5000c500a1b2c3d4:a,raw
+        path = os.path.realpath("/dev/rdsk/%ss0" % disk)
+        if path.startswith("/devices/"):
+            path = path[len("/devices"):]
+        path = path.rsplit(":", 1)[0]
+        if path in insts:
+            names[disk] = insts[path]
+        else:
+            logger.debug("No driver instance for %s at %s", disk, path)
+
+    return names
+
+
+def parse(lines):
+    """
+    Parse 'kstat -p' output of the disk and device_error classes.
+
+    Args:
+        lines (iterable): Output lines
+    Returns:
+        A dict keyed by kstat name, i.e. "sd12" and "sd12,err", of dicts of
+        values keyed by statistic.
+    """
+    stats = {}
+
+    for line in lines:
+        key, _, value = line.rstrip("\n").partition("\t")
+        fields = key.split(":", 3)
+        if not value or len(fields) != 4:
+            continue
+        stats.setdefault(fields[2], {})[fields[3]] = \
+            kstat.number(value.strip())
+
+    return stats
+
+
+def counters(io, err):
+    """
+    Select the counters of a disk.
+
+    Args:
+        io (dict): disk kstat
+        err (dict): device_error kstat
+    Returns:
+        A dict of the I/O counters and the error counters.
+    """
+    c = dict((k, io.get(k, 0)) for k in IO)
+    for k, name in ERRORS:
+        c[k] = err.get(name, 0)
+
+    return c
+
+
+def snapshot(disks):
+    """
+    Read the counters of all disks with a single kstat query.
+
+    Args:
+        disks (list): Logical device names
+    Returns:
+        A dict of counters() keyed by disk, disks without kstats are left
+        out.
+    """
+    names = kstat_names(disks)
+    output = execute("kstat -p -c disk; kstat -p -c device_error",
+                     timeout=60)
+    stats = parse(output.splitlines())
+    snap = {}
+
+    for disk, name in names.items():
+        if name in stats:
+            snap[disk] = counters(stats[name], stats.get("%s,err" % name, {}))
+
+    return snap
+
+
+def delta(before, after):
+    """
+    Compute the changes of a disk's counters.
+
+    Args:
+        before (dict): Counters before
+        after (dict): Counters after
+    Returns:
+        A dict with the number of I/Os "ops", the MB "read" and "written",
+        the average wait "wsvc_t" and active "asvc_t" service times in ms
+        and the "errors" by type.
+    """
+    d = dict((k, after.get(k, 0) - before.get(k, 0)) for k in after)
+    ops = d.get("reads", 0) + d.get("writes", 0)
+
+    return {
+        "ops": ops,
+        "read": round(d.get("nread", 0) / 1024.0 ** 2, 3),
+        "written": round(d.get("nwritten", 0) / 1024.0 ** 2, 3),
+        "wsvc_t": round(d.get("wlentime", 0) / ops / 1e6, 3) if ops
+        else None,
+        "asvc_t": round(d.get("rlentime", 0) / ops / 1e6, 3) if ops
+        else None,
+        "errors": dict((k, d.get(k, 0)) for k, _ in ERRORS)
+    }
+
+
+def baseline(counters):
+    """
+    Return the average active service time in ms since boot, None if the
+    disk did no I/O.
+    """
+    ops = counters.get("reads", 0) + counters.get("writes", 0)
+    if not ops:
+        return None
+
+    return round(counters.get("rlentime", 0) / ops / 1e6, 3)
@@ -0,0 +1,279 @@
+"""
+diskbench.py
+
+In-process sequential disk read benchmark.
+
+Disks are read with a preallocated buffer and every read is timed into a
+log2 latency histogram. Counters and histograms live in slots of a shared
+memory array, one slot per disk, so the benchmark runs in threads of this
+process or in a pool of worker processes and the parent aggregates the slots
+without any per-read data being pickled. Both engines run the same code on
+the same slots, so their per-disk results are identical in form.
+
+Copyright (c) 2016  Nexenta Systems
+William Kettler <william.kettler@nexenta.com>
+"""
+
+import logging
+import multiprocessing
+from time import perf_counter
+from threading import Thread
+from queue import Queue, Empty
+
+
+logger = logging.getLogger(__name__)
+
+ENGINES = ("thread", "process")
+
+# Slot layout, the counters followed by the histogram. Bucket b counts the
+# reads taking [2^(b-1), 2^b) microseconds, the last bucket is open ended.
+STATUS, BYTES, READS, ELAPSED = range(4)
+BUCKETS = 32
+FIELDS = 4 + BUCKETS
+
+# Slot status
+PENDING, DONE, FAILED = range(3)
+
+
+def device(disk):
+    """
+    Return the raw device path of a disk.
+    """
+    return "/dev/rdsk/%ss0" % disk
+
+
+class Slots(object):
+    """
+    Per-disk result slots in shared memory.
+
+    The array is allocated before the workers are forked so they inherit it,
+    every worker only writes the slots of the disks it is assigned.
+
+    Attributes:
+        n (int): Number of slots
+        array (RawArray): FIELDS 64-bit integers per slot
+    """
+
+    def __init__(self, n):
+        self.n = n
+        self.array = multiprocessing.RawArray("q", n * FIELDS)
+
+    def view(self, i):
+        """
+        Return a writable view of a slot.
+        """
+        return memoryview(self.array).cast("B").cast("q")[
+            i * FIELDS:(i + 1) * FIELDS]
+
+    def result(self, i):
+        """
+        Decode a slot.
+
+        Args:
+            i (int): Slot index
+        Returns:
+            A dict with the "tput" in MB/s, the number of "reads", the p50,
+            p99 and max read latency in ms, as bucket upper bounds, and the
+            "histogram" counts. None if the slot was not completed.
+        """
+        slot = self.view(i)
+        if slot[STATUS] != DONE or not slot[ELAPSED]:
+            return None
+
+        histogram = list(slot[4:])
+        while histogram and not histogram[-1]:
+            histogram.pop()
+
+        return {
+            "tput": slot[BYTES] / (slot[ELAPSED] / 1e9) / 1024 ** 2,
+            "reads": slot[READS],
+            "p50": _bound(histogram, 50),
+            "p99": _bound(histogram, 99),
+            "max": _bound(histogram, 100),
+            "histogram": histogram
+        }
+
+
+def _bound(histogram, p):
+    """
+    Return the upper bound in ms of the bucket holding the p-th percentile.
+    """
+    total = sum(histogram)
+    if not total:
+        return None
+
+    rank = total * p / 100.0
+    seen = 0
+    for b, count in enumerate(histogram):
+        seen += count
+        if count and seen >= rank:
+            return 2 ** b / 1000.0
+
+
+def read(path, bs, duration, slot):
+    """
+    Read a device sequentially for a duration, wrapping around at the end,
+    and record the counters and histogram in a slot.
+
+    Args:
+        path (str): Device path
+        bs (int): Block size in bytes
+        duration (float): Duration in seconds
+        slot (memoryview): Slot to record in
+    """
+    buf = bytearray(bs)
+    last = BUCKETS - 1
+    total = 0
+    reads = 0
+
+    with open(path, "rb", buffering=0) as fh:
+        start = perf_counter()
+        deadline = start + duration
+        done = start
+        while done < deadline:
+            t = done
+            n = fh.readinto(buf)
+            done = perf_counter()
+            if not n:
+                if not total:
+                    raise RuntimeError("%s is empty" % path)
+                fh.seek(0)
+                continue
+            total += n
+            reads += 1
+            b = int((done - t) * 1e6).bit_length()
+            slot[4 + (b if b < last else last)] += 1
+
+    slot[BYTES] = total
+    slot[READS] = reads
+    slot[ELAPSED] = int((done - start) * 1e9)
+    slot[STATUS] = DONE
+
+
+def _task(slots, i, disk, bs, duration):
+    """
+    Benchmark one disk into its slot.
+
+    Returns:
+        A (slot, error) tuple, the error is None on success.
+    """
+    logger.info("Verifying %s performance", disk)
+    slot = slots.view(i)
+
+    try:
+        read(device(disk), bs, duration, slot)
+    except (IOError, OSError, RuntimeError) as e:
+        logger.error("Failed to read %s", disk)
+        logger.debug(str(e), exc_info=True)
+        slot[STATUS] = FAILED
+        return i, str(e)
+
+    return i, None
+
+
+# Slots inherited by the pool workers
+_slots = None
+
+
+def _init(slots):
+    global _slots
+    _slots = slots
+
+
+def _process_task(args):
+    return _task(_slots, *args)
+
+
+def _threads(slots, tasks, workers, done):
+    """
+    Run the tasks in a pool of threads.
+    """
+    errors = {}
+    taskq = Queue()
+    [taskq.put(t) for t in tasks]
+
+    def worker():
+        while True:
+            try:
+                t = taskq.get_nowait()
+            except Empty:
+                break
+            i, error = _task(slots, *t)
+            errors[i] = error
+            done(i, error)
+
+    thrs = []
+    for _ in range(workers):
+        t = Thread(target=worker)
+        t.start()
+        thrs.append(t)
+    for t in thrs:
+        t.join()
+
+    return errors
+
+
+def _processes(slots, tasks, workers, done):
+    """
+    Run the tasks in a pool of forked processes, only the slot index and
+    error of each disk are passed back.
+    """
+    errors = {}
+    ctx = multiprocessing.get_context("fork")
+    pool = ctx.Pool(workers, initializer=_init, initargs=(slots,))
+    try:
+        for i, error in pool.imap_unordered(_process_task, tasks):
+            errors[i] = error
+            done(i, error)
+    finally:
+        pool.close()
+        pool.join()
+
+    return errors
+
+
+def run(disks, bs, duration, workers=8, engine="thread", callback=None):
+    """
+    Benchmark disks concurrently.
+
+    Args:
+        disks (list): Logical device names
+        bs (int): Block size in bytes
+        duration (float): Duration per disk in seconds
+    Kwargs:
+        workers (int): Number of disks read at the same time
+        engine (str): "thread" or "process"
+        callback (function): Called with the disk, result and error as each
+                             disk completes
+    Returns:
+        A list of (disk, result, error) tuples in the order of the disks,
+        result is as returned by Slots.result() and None on failure.
+    """
+    if engine not in ENGINES:
+        raise RuntimeError("Unknown disk benchmark engine '%s'" % engine)
+
+    if not disks:
+        return []
+
+    slots = Slots(len(disks))
+    tasks = [(i, d, bs, duration) for i, d in enumerate(disks)]
+    workers = max(1, min(workers, len(disks)))
+
+    def done(i, error):
+        if callback is not None:
+            callback(disks[i], slots.result(i), error)
+
+    if engine == "thread":
+        errors = _threads(slots, tasks, workers, done)
+    else:
+        errors = _processes(slots, tasks, workers, done)
+
+    results = []
+    for i, disk in enumerate(disks):
+        result = slots.result(i)
+        error = errors.get(i)
+        if result is None and error is None:
+            error = "No result recorded"
+        results.append((disk, result, error))
+
+    return results
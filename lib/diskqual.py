@@ -9,14 +9,24 @@ William Kettler <william.kettler@nexenta.com>
 
 import sys
 import os
+import re
 import time
+import select
+import signal
 import subprocess
 import logging
+from array import array
 from lib.execute import RetcodeError
+from lib.logs import Payload
+from lib.stats import precision as rel_precision
 
 
 logger = logging.getLogger(__name__)
 
+# The dd summary line, i.e.
+# 4030464 bytes (4.0 MB, 3.8 MiB) copied, 1.00259 s, 4.0 MB/s
+SUMMARY = re.compile(r"^(\d+) bytes .*copied, ([\d.]+) s")
+
 
 def dd(ifile, ofile, bs, duration):
     """
@@ -62,7 +72,7 @@ def dd(ifile, ofile, bs, duration):
     # Read the stdout/sterr buffers
     boutput, _ = ph.communicate()
     output = boutput.decode(sys.stdout.encoding)
-    logger.debug(output)
+    logger.debug("%s", Payload(output))
 
     # Verify return code
     # A negative return code indicates the process received a signal
@@ -85,6 +95,150 @@ def dd(ifile, ofile, bs, duration):
     return tput
 
 
+class _Output(object):
+    """
+    Incremental reader of the dd output.
+
+    Attributes:
+        fd (int): dd stdout/stderr file descriptor
+        lines (list): All output lines read so far
+    """
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.lines = []
+        self._buf = b""
+        self.eof = False
+
+    def summary(self, timeout):
+        """
+        Read until the next summary line.
+
+        Args:
+            timeout (float): Seconds to wait for the summary
+        Returns:
+            The (bytes, seconds) tuple or None if dd exited first.
+        """
+        deadline = time.time() + timeout
+        while True:
+            while b"\n" in self._buf:
+                bline, self._buf = self._buf.split(b"\n", 1)
+                line = bline.decode(sys.stdout.encoding)
+                self.lines.append(line)
+                m = SUMMARY.match(line)
+                if m:
+                    return int(m.group(1)), float(m.group(2))
+
+            if self.eof:
+                return None
+
+            remaining = deadline - time.time()
+            if remaining <= 0 or \
+                    not select.select([self.fd], [], [], remaining)[0]:
+                raise RuntimeError("dd did not report its progress")
+
+            chunk = os.read(self.fd, 4096)
+            if chunk:
+                self._buf += chunk
+            else:
+                self.eof = True
+                self._buf += b"\n"
+
+
+def dd_converge(ifile, ofile, bs, interval=1, min_duration=2,
+                max_duration=30, precision=0.05, confidence=0.95):
+    """
+    dd wrapper which samples the throughput every interval and stops as soon
+    as the throughput estimate is within the requested precision.
+
+    Written for GNU dd which reports its progress on SIGUSR1. The first
+    interval is treated as warm-up and excluded from the estimate.
+
+    Args:
+        ifile    (str): Input file
+        ofile    (str): Output file
+        bs       (str): Block size in KB
+    Kwargs:
+        interval     (float): Sample interval in seconds
+        min_duration (float): Minimum duration in seconds
+        max_duration (float): Maximum duration in seconds
+        precision    (float): Relative confidence interval half-width to
+                              stop at, i.e. 0.05 for +/- 5%
+        confidence   (float): Confidence level, 0.90, 0.95 or 0.99
+    Returns:
+        A dict with the throughput in MB/s, the number of samples, the
+        achieved precision and the duration in seconds.
+    """
+    ddcmd = "/usr/gnu/bin/dd"
+
+    if not os.path.isfile(ddcmd):
+        raise RuntimeError("'%s' does not exist" % ddcmd)
+
+    cmd = "%s if=%s of=%s bs=%sK" % (ddcmd, ifile, ofile, bs)
+
+    logger.debug(cmd)
+
+    ph = subprocess.Popen(cmd.split(), stdout=subprocess.PIPE,
+                          stderr=subprocess.STDOUT)
+    output = _Output(ph.stdout.fileno())
+
+    samples = array("d")
+    points = []
+    achieved = None
+    try:
+        while True:
+            time.sleep(interval)
+            if ph.poll() is not None:
+                break
+            ph.send_signal(signal.SIGUSR1)
+            point = output.summary(timeout=max(interval, 5))
+            if point is None:
+                break
+
+            # Throughput of the last interval, the first one is warm-up
+            if points and point[1] > points[-1][1]:
+                samples.append((point[0] - points[-1][0]) /
+                               (point[1] - points[-1][1]) / 1024 ** 2)
+            points.append(point)
+
+            if len(samples) >= 2:
+                achieved = rel_precision(samples, confidence)
+            if point[1] >= max_duration:
+                break
+            if point[1] >= min_duration and achieved is not None and \
+                    achieved <= precision:
+                break
+    finally:
+        if ph.poll() is None:
+            ph.send_signal(signal.SIGINT)
+        retcode = ph.wait()
+
+    # Drain the final summary
+    while output.summary(timeout=5) is not None:
+        pass
+    ph.stdout.close()
+
+    logger.debug("'%s' return code is %s", cmd, retcode)
+    logger.debug("%s", Payload("\n".join(output.lines)))
+
+    if not (retcode == 0 or retcode == -signal.SIGINT):
+        raise RetcodeError(cmd, retcode, output="\n".join(output.lines))
+
+    if len(points) < 2:
+        raise RuntimeError("Not enough samples collected from %s" % ifile)
+
+    # Throughput over the sampled window excluding the warm-up interval
+    size = points[-1][0] - points[0][0]
+    t = points[-1][1] - points[0][1]
+
+    return {
+        "tput": size / t / 1024 ** 2,
+        "samples": len(samples),
+        "precision": achieved,
+        "duration": points[-1][1]
+    }
+
+
 def r_seq(disk, bs, duration):
     """
     Sequential disk read.
@@ -104,3 +258,20 @@ def r_seq(disk, bs, duration):
         raise
 
     return tput
+
+
+def r_seq_converge(disk, bs, **kwargs):
+    """
+    Sequential disk read until the throughput estimate converges.
+
+    Args:
+        disk (str): Device ID
+        bs (int): Block size in KB
+    Kwargs:
+        Passed to dd_converge
+    Returns:
+        The dd_converge results.
+    """
+    logger.debug("r_seq_converge test on %s", disk)
+
+    return dd_converge("/dev/rdsk/%ss0" % disk, "/dev/null", bs, **kwargs)
@@ -7,20 +7,19 @@ Copyright (C) 2016  Nexenta Systems
 William Kettler <william.kettler@nexenta.com>
 """
 
+import os
 import sys
 import subprocess
 import signal
 import logging
+import lib.shell as shell
+from lib.logs import Payload
 
 
 logger = logging.getLogger(__name__)
 
-
-class _Signal(Exception):
-    """
-    This exception is raise by the signal handler.
-    """
-    pass
+# Run the commands in a persistent shell co-process
+persistent = False
 
 
 class TimeoutError(Exception):
@@ -62,17 +61,12 @@ class RetcodeError(Exception):
                (self.cmd, self.retcode)
 
 
-def alarm_handler(signum, frame):
-    """
-    We only get here if the timeout is exceeded.
-    """
-    raise _Signal
-
-
 def execute(cmd, timeout=None):
     """
     Execute a command in the default shell. If a timeout is defined the command
     will be killed if the timeout is exceeded and an exception will be raised.
+    If persistent is set the command is sent to the calling thread's shell
+    co-process rather than a new shell.
 
     Args:
         cmd (str): Command to execute
@@ -82,36 +76,50 @@ def execute(cmd, timeout=None):
     """
     logger.debug(cmd)
 
-    # Define the timeout signal
-    if timeout:
-        signal.signal(signal.SIGALRM, alarm_handler)
-        signal.alarm(timeout)
+    if persistent:
+        try:
+            retcode, boutput = shell.get().run(cmd, timeout=timeout)
+        except shell.Timeout:
+            raise TimeoutError(cmd=cmd, timeout=timeout)
+        output = boutput.decode(sys.stdout.encoding)
+        if retcode:
+            raise RetcodeError(cmd, retcode, output=output)
+        logger.debug("%s", Payload(output))
+        return output
 
+    phandle = None
     try:
         # Execute the command and wait for the subprocess to terminate
-        # STDERR is redirected to STDOUT
+        # STDERR is redirected to STDOUT. The command gets its own process
+        # group so it can be killed together with its children.
         phandle = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
-                                   stderr=subprocess.STDOUT)
-
-        # Read the stdout/sterr buffers and retcode
-        boutput, _ = phandle.communicate()
+                                   stderr=subprocess.STDOUT,
+                                   start_new_session=True)
+
+        # Read the stdout/sterr buffers and retcode, the timeout doesn't
+        # rely on SIGALRM so commands can be executed from any thread
+        try:
+            boutput, _ = phandle.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            # Kill the running process
+            os.killpg(phandle.pid, signal.SIGKILL)
+            phandle.communicate()
+            raise TimeoutError(cmd=cmd, timeout=timeout)
         output = boutput.decode(sys.stdout.encoding)
         retcode = phandle.poll()
-    except _Signal:
-        # Kill the running process
-        phandle.kill()
-        raise TimeoutError(cmd=cmd, timeout=timeout)
+    except TimeoutError:
+        raise
     except:
         logger.debug("Unhandled exception", exc_info=True)
+        # The process group doesn't receive the user's SIGINT
+        if phandle is not None and phandle.poll() is None:
+            os.killpg(phandle.pid, signal.SIGKILL)
         raise
-    else:
-        # Possible race condition where alarm isn't disabled in time
-        signal.alarm(0)
 
     # Raise an exception if the command exited with non-zero exit status
     if retcode:
         raise RetcodeError(cmd, retcode, output=output)
 
-    logger.debug(output)
+    logger.debug("%s", Payload(output))
 
     return output
@@ -0,0 +1,233 @@
+"""
+fleet.py
+
+Run the API based checks against many appliances from a single controller
+host.
+
+Each appliance is handled by a worker process which points the NEF client
+defaults at the appliance and runs the configured checks with a bounded
+number of threads. Checks requiring local execution are skipped.
+
+Copyright (c) 2016  Nexenta Systems
+William Kettler <william.kettler@nexenta.com>
+"""
+
+import os
+import json
+import logging
+import multiprocessing
+import lib.nefclient as nefclient
+import lib.results as results
+from collections import OrderedDict
+from lib.runner import get_check, run_checks, succeeded
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_inventory(f):
+    """
+    Parse the JSON inventory file.
+
+    e.g.
+    [
+        {
+            "name": "nexenta1",
+            "url": "https://10.0.0.1:8443",
+            "username": "admin",
+            "password": "secret",
+            "concurrency": 2
+        }
+    ]
+
+    Args:
+        f (str): Path to JSON
+    Returns:
+        A list of appliances.
+    """
+    required = ["name", "url"]
+
+    try:
+        with open(f) as fh:
+            inventory = json.load(fh)
+    except IOError as i:
+        logger.debug(str(i), exc_info=True)
+        raise RuntimeError("Failed to open the inventory file")
+    except ValueError as v:
+        logger.debug(str(v), exc_info=True)
+        raise RuntimeError("Failed to parse the inventory file")
+
+    names = set()
+    for a in inventory:
+        if len(set(required) & set(a.keys())) != len(required):
+            raise RuntimeError("The appliance is missing required objects: "
+                               "%s" % a.get("name", a.get("url")))
+        if a["name"] in names:
+            raise RuntimeError("Duplicate appliance name '%s'" % a["name"])
+        names.add(a["name"])
+
+    return inventory
+
+
+def _skipped(c):
+    """
+    Return the output entry of a check which can't be run remotely.
+    """
+    return {
+        "f": c["f"],
+        "args": c["args"],
+        "kwargs": c["kwargs"],
+        "result": {
+            "success": None,
+            "skipped": True,
+            "error": "The check requires local execution on the appliance"
+        }
+    }
+
+
+def _run_checks(checks, concurrency):
+    """
+    Run the checks against the current default appliance.
+
+    Args:
+        checks (list): Configured checks
+        concurrency (int): Number of checks run at the same time
+    Returns:
+        The results dict keyed by check name.
+    """
+    queued = []
+    results = {}
+
+    for c in checks:
+        if not c["enabled"]:
+            continue
+        try:
+            remote = not getattr(get_check(c), "local_only", False)
+        except RuntimeError:
+            # Let the runner record the missing function
+            remote = True
+        if remote:
+            queued.append(c)
+        else:
+            results[c["name"]] = _skipped(c)
+
+    results.update(run_checks(queued, max(1, concurrency)))
+
+    # Preserve the configured check order
+    return OrderedDict((c["name"], results[c["name"]]) for c in checks
+                       if c["name"] in results)
+
+
+def _run_appliance(args):
+    """
+    Process pool worker running all checks against a single appliance.
+
+    Args:
+        args (tuple): Appliance, checks, output directory, default
+                      concurrency, version and output compression
+    Returns:
+        The appliance summary.
+    """
+    appliance, checks, outdir, concurrency, version, compression = args
+    name = appliance["name"]
+    output = os.path.join(outdir, "%s-autosac.json%s" %
+                          (name, results.COMPRESSIONS[compression][0]))
+    summary = {
+        "name": name,
+        "url": appliance["url"],
+        "output": output,
+        "success": False,
+        "passed": 0,
+        "failed": 0,
+        "skipped": 0,
+        "error": None
+    }
+
+    logger.info("Appliance %s checks in progress", name)
+
+    # Every client created in this process now talks to the appliance
+    nefclient.defaults.update({
+        "url": appliance["url"],
+        "username": appliance.get("username"),
+        "password": appliance.get("password")
+    })
+
+    try:
+        checked = _run_checks(checks,
+                              appliance.get("concurrency", concurrency))
+        results.dump(output, {
+            "version": version,
+            "appliance": name,
+            "results": checked
+        }, compression=compression)
+    # Catch all clause so one bad appliance doesn't stop the fleet
+    except Exception as e:
+        logger.error("Appliance %s failed: %s", name, str(e))
+        logger.debug(str(e), exc_info=True)
+        summary["error"] = str(e)
+        return summary
+
+    for r in checked.values():
+        state = succeeded(r["result"])
+        if state is None:
+            summary["skipped"] += 1
+        elif state:
+            summary["passed"] += 1
+        else:
+            summary["failed"] += 1
+    summary["success"] = summary["failed"] == 0
+
+    logger.info("Appliance %s checks completed, %d passed, %d failed, "
+                "%d skipped", name, summary["passed"], summary["failed"],
+                summary["skipped"])
+
+    return summary
+
+
+def run(inventory, checks, outdir, version, workers=8, concurrency=2,
+        compression=None):
+    """
+    Run the checks against every appliance in the inventory.
+
+    One output file is written per appliance plus a combined summary.
+
+    Args:
+        inventory (list): Appliances
+        checks (list): Configured checks
+        outdir (str): Output directory
+        version (str): AutoSAC version
+    Kwargs:
+        workers (int): Number of appliances checked at the same time
+        concurrency (int): Default number of checks run at the same time
+                           against one appliance
+        compression (str): Output compression, None, "gzip" or "xz"
+    Returns:
+        The fleet summary as a list.
+    """
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+    jobs = [(a, checks, outdir, concurrency, version, compression)
+            for a in inventory]
+    summaries = {}
+
+    pool = multiprocessing.Pool(processes=max(1, min(workers, len(jobs))))
+    try:
+        for s in pool.imap_unordered(_run_appliance, jobs):
+            summaries[s["name"]] = s
+    finally:
+        pool.close()
+        pool.join()
+
+    summary = [summaries[a["name"]] for a in inventory]
+
+    path = os.path.join(outdir, "fleet-summary.json")
+    with open(path, "w") as fh:
+        json.dump({
+            "version": version,
+            "appliances": summary
+        }, fh, indent=4)
+
+    logger.info("Fleet summary saved to %s", path)
+
+    return summary
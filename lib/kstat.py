@@ -0,0 +1,92 @@
+"""
+kstat.py
+
+Readers for kernel statistics.
+
+On illumos the statistics are read with the kstat command in parsable
+format, on Linux ZFS exports the same statistics under /proc/spl/kstat.
+Readers are plain functions returning a dict of counters so recorded output
+can be replayed.
+
+Copyright (c) 2016  Nexenta Systems
+William Kettler <william.kettler@nexenta.com>
+"""
+
+import os
+import logging
+from lib.execute import execute
+
+
+logger = logging.getLogger(__name__)
+
+# Linux ZFS ARC statistics
+PROC_ARCSTATS = "/proc/spl/kstat/zfs/arcstats"
+
+
+def number(v):
+    """
+    Convert a statistic to a number, leaving other values as they are.
+    """
+    try:
+        return int(v)
+    except ValueError:
+        try:
+            return float(v)
+        except ValueError:
+            return v
+
+
+def parse_kstat(lines):
+    """
+    Parse 'kstat -p' output, "module:instance:name:statistic<TAB>value".
+
+    Args:
+        lines (iterable): Output lines
+    Returns:
+        A dict of values keyed by statistic, the last kstat listed wins.
+    """
+    stats = {}
+
+    for line in lines:
+        key, _, value = line.rstrip("\n").partition("\t")
+        if not value:
+            continue
+        stats[key.split(":")[-1]] = number(value.strip())
+
+    return stats
+
+
+def parse_proc(lines):
+    """
+    Parse a /proc/spl/kstat file, "name type data" rows after a header.
+
+    Args:
+        lines (iterable): File lines
+    Returns:
+        A dict of values keyed by statistic.
+    """
+    stats = {}
+
+    for line in lines:
+        fields = line.split()
+        if len(fields) != 3 or fields[0] == "name" or \
+                not fields[1].isdigit():
+            continue
+        stats[fields[0]] = number(fields[2])
+
+    return stats
+
+
+def arcstats():
+    """
+    Read the ZFS ARC statistics of this host.
+
+    Returns:
+        A dict of values keyed by statistic.
+    """
+    if os.path.exists(PROC_ARCSTATS):
+        with open(PROC_ARCSTATS) as fh:
+            return parse_proc(fh)
+
+    return parse_kstat(execute("kstat -p zfs:0:arcstats",
+                               timeout=30).splitlines())
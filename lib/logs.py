@@ -0,0 +1,255 @@
+"""
+logs.py
+
+Asynchronous logging.
+
+The handlers defined in the logging config are moved behind a queue so the
+checks only pay for queueing the record; rendering the message, formatting
+and writing the log records happens in a single listener thread. Large
+payloads are wrapped in Payload objects so they are only serialized, up to
+a size limit, by the listener if a handler consumes the record. As the
+arguments are rendered later they must not be modified once logged.
+
+Forked children, i.e. multiprocessing workers, write their records
+synchronously. The listener is paused around fork() so a child never
+inherits a handler or stream lock held by the listener thread.
+
+Copyright (c) 2016  Nexenta Systems
+William Kettler <william.kettler@nexenta.com>
+"""
+
+import os
+import json
+import queue
+import atexit
+import logging
+import threading
+import logging.config
+from logging.handlers import QueueHandler, QueueListener
+
+
+# Maximum number of characters of a payload written to the log
+limit = 4096
+
+_listener = None
+
+# Held by the listener while it dispatches a record and across fork()
+_fork_lock = threading.Lock()
+
+
+class Payload(object):
+    """
+    Lazily rendered, size-capped log payload.
+
+    e.g.
+    logger.debug("%s", Payload(body))
+
+    Attributes:
+        obj (object): The payload, strings are logged as is and anything else
+                      is serialized as JSON
+    """
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __str__(self):
+        if isinstance(self.obj, str):
+            text = self.obj
+            if len(text) <= limit:
+                return text
+            return "%s... (%d characters)" % (text[:limit], len(text))
+
+        # Stop serializing once the limit is reached
+        size = 0
+        chunks = []
+        encoder = json.JSONEncoder(default=str)
+        for chunk in encoder.iterencode(self.obj):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size > limit:
+                return "%s... (truncated)" % "".join(chunks)[:limit]
+
+        return "".join(chunks)
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Format each log record as a single line JSON object.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "function": record.funcName,
+            "thread": record.threadName,
+            "message": record.getMessage()
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+
+        return json.dumps(entry)
+
+
+class _QueueHandler(QueueHandler):
+    """
+    Queue the records of a logger together with the handlers they are
+    destined for.
+
+    Records emitted by a forked child, which has no listener thread, are
+    handled synchronously.
+
+    Attributes:
+        targets (list): The logger's original handlers
+    """
+
+    def __init__(self, q, targets):
+        QueueHandler.__init__(self, q)
+        self.targets = targets
+        self.pid = os.getpid()
+        self.setLevel(min(h.level for h in targets))
+
+    def prepare(self, record):
+        # The message is rendered by the listener
+        return record
+
+    def enqueue(self, record):
+        self.queue.put_nowait((record, self.targets))
+
+    def emit(self, record):
+        if os.getpid() != self.pid:
+            _dispatch(record, self.targets)
+        else:
+            QueueHandler.emit(self, record)
+
+
+class _Listener(QueueListener):
+    """
+    Dispatch the queued records to their handlers honouring handler levels.
+    """
+
+    def handle(self, item):
+        with _fork_lock:
+            _dispatch(*item)
+
+
+def _dispatch(record, targets):
+    """
+    Render a record's message once and pass the record to the handlers whose
+    level it meets.
+    """
+    handlers = [h for h in targets if record.levelno >= h.level]
+    if not handlers:
+        return
+
+    # A record with bad arguments must not stop the listener
+    try:
+        record.msg = record.getMessage()
+        record.args = None
+    except Exception:
+        handlers[0].handleError(record)
+        return
+
+    for h in handlers:
+        try:
+            h.handle(record)
+        except Exception:
+            h.handleError(record)
+
+
+def _before_fork():
+    _fork_lock.acquire()
+
+
+def _after_fork_parent():
+    _fork_lock.release()
+
+
+def _after_fork_child():
+    global _fork_lock
+
+    _fork_lock = threading.Lock()
+    # Locks of handlers other threads were using at the time of the fork
+    for l in [logging.getLogger()] + \
+            list(logging.Logger.manager.loggerDict.values()):
+        for h in getattr(l, "handlers", []):
+            h.createLock()
+            for t in getattr(h, "targets", []):
+                t.createLock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(before=_before_fork,
+                        after_in_parent=_after_fork_parent,
+                        after_in_child=_after_fork_child)
+
+
+def handlers():
+    """
+    Return the handlers the records are written by, the targets of the
+    queued handlers once logging is set up.
+
+    Returns:
+        A list of handlers.
+    """
+    found = []
+    loggers = [logging.getLogger()] + \
+        [l for l in logging.Logger.manager.loggerDict.values()
+         if isinstance(l, logging.Logger)]
+    for l in loggers:
+        for h in l.handlers:
+            for t in getattr(h, "targets", [h]):
+                if t not in found:
+                    found.append(t)
+
+    return found
+
+
+def setup(path, json_format=False):
+    """
+    Configure logging from a config file and move all handlers behind a
+    queue served by a listener thread.
+
+    Args:
+        path (str): Path to the logging config
+    Kwargs:
+        json_format (bool): Write JSON records to the log files
+    """
+    global _listener
+
+    logging.config.fileConfig(path)
+
+    if json_format:
+        formatter = JSONFormatter()
+
+    q = queue.Queue(-1)
+    loggers = [logging.getLogger()] + \
+        [l for l in logging.Logger.manager.loggerDict.values()
+         if isinstance(l, logging.Logger)]
+    for l in loggers:
+        if not l.handlers:
+            continue
+        targets = list(l.handlers)
+        if json_format:
+            for h in targets:
+                if isinstance(h, logging.FileHandler):
+                    h.setFormatter(formatter)
+        l.handlers = [_QueueHandler(q, targets)]
+
+    _listener = _Listener(q)
+    _listener.start()
+    atexit.register(shutdown)
+
+
+def shutdown():
+    """
+    Write the queued records and stop the listener thread.
+    """
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,110 @@
+"""
+mdb.py
+
+Read kernel variables with the modular debugger.
+
+All variables are read by a single mdb invocation, one "symbol/format"
+command per variable, and its output is parsed in one pass.
+
+Copyright (c) 2016  Nexenta Systems
+William Kettler <william.kettler@nexenta.com>
+"""
+
+import re
+import logging
+from lib.execute import execute, RetcodeError
+
+
+logger = logging.getLogger(__name__)
+
+# Valid symbol names and format characters, they are passed to the shell
+SYMBOL = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+FORMAT = re.compile(r"^[A-Za-z]$")
+
+# Formats printed as decimal and hexadecimal integers
+DECIMAL = "DdEeUu"
+HEXADECIMAL = "XxJKk"
+
+# "symbol:   value" lines, mdb prints an empty one before each value
+VALUE = re.compile(r"^([A-Za-z_][A-Za-z0-9_]*):\s*(\S.*?)\s*$")
+
+
+def command(variables):
+    """
+    Return the shell command reading the variables.
+
+    Args:
+        variables (list): (symbol, format) tuples
+    Returns:
+        The command as a str.
+    """
+    for symbol, fmt in variables:
+        if not SYMBOL.match(symbol) or not FORMAT.match(fmt):
+            raise ValueError("Invalid variable %s/%s" % (symbol, fmt))
+
+    return "printf '%s\\n' | mdb -k" % \
+        "\\n".join("%s/%s" % v for v in variables)
+
+
+def convert(value, fmt):
+    """
+    Convert a printed value according to its format, other formats are
+    returned as printed.
+    """
+    try:
+        if fmt in DECIMAL:
+            return int(value, 10)
+        if fmt in HEXADECIMAL:
+            return int(value, 16)
+    except ValueError:
+        pass
+
+    return value
+
+
+def parse(output, variables):
+    """
+    Parse the mdb output.
+
+    Args:
+        output (str): mdb output
+        variables (list): (symbol, format) tuples
+    Returns:
+        A dict of values keyed by symbol, symbols mdb failed to read are
+        missing.
+    """
+    formats = dict(variables)
+    values = {}
+
+    for line in output.splitlines():
+        m = VALUE.match(line)
+        if m is None or m.group(1) not in formats:
+            continue
+        values[m.group(1)] = convert(m.group(2), formats[m.group(1)])
+
+    return values
+
+
+def read(variables, timeout=10):
+    """
+    Read kernel variables in a single mdb session.
+
+    Args:
+        variables (list): (symbol, format) tuples
+    Kwargs:
+        timeout (int): mdb timeout in seconds
+    Returns:
+        A dict of values keyed by symbol, symbols mdb failed to read are
+        missing.
+    """
+    cmd = command(variables)
+    try:
+        output = execute(cmd, timeout=timeout)
+    except RetcodeError as r:
+        # mdb exits non-zero if any symbol is unknown, keep the others
+        logger.debug("%s", r.output)
+        if not r.output:
+            raise
+        output = r.output
+
+    return parse(output, variables)
@@ -0,0 +1,162 @@
+"""
+metrics.py
+
+Export check results in the Prometheus text format, either to a file for the
+node exporter textfile collector or from a local HTTP endpoint.
+
+Copyright (c) 2016  Nexenta Systems
+William Kettler <william.kettler@nexenta.com>
+"""
+
+import os
+import logging
+import threading
+from collections import OrderedDict
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from lib.results import flatten
+from lib.runner import succeeded
+
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "autosac"
+
+
+def _escape(v):
+    """
+    Escape a label value.
+    """
+    return str(v).replace("\\", "\\\\").replace("\"", "\\\"") \
+        .replace("\n", "\\n")
+
+
+def _labels(labels):
+    """
+    Format a list of (name, value) label pairs.
+    """
+    return ",".join("%s=\"%s\"" % (k, _escape(v)) for k, v in labels)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    Serve the current metrics on any path.
+    """
+
+    def do_GET(self):
+        body = self.server.exporter.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+class Exporter(object):
+    """
+    Keeps the latest result of each check and exports it.
+
+    Attributes:
+        textfile (str): Optional path of the metrics file
+        listen (tuple): Optional (host, port) to serve the metrics on
+    """
+
+    def __init__(self, textfile=None, listen=None):
+        self.textfile = textfile
+        self.listen = listen
+        self.checks = OrderedDict()
+        self.lock = threading.Lock()
+        self.server = None
+
+        if listen is not None:
+            self.server = HTTPServer(listen, _Handler)
+            self.server.exporter = self
+            t = threading.Thread(target=self.server.serve_forever)
+            t.daemon = True
+            t.start()
+            logger.info("Serving metrics on %s:%d", listen[0], listen[1])
+
+    def update(self, name, result, duration, timestamp):
+        """
+        Record the latest result of a check and rewrite the metrics file.
+
+        Args:
+            name (str): Check name
+            result (dict|list): Check results
+            duration (float): Check duration in seconds
+            timestamp (float): Completion time as a UNIX timestamp
+        """
+        with self.lock:
+            self.checks[name] = (result, duration, timestamp)
+
+        if self.textfile is not None:
+            self.write()
+
+    def render(self):
+        """
+        Render the metrics in the Prometheus text format.
+
+        Returns:
+            The metrics as a string.
+        """
+        with self.lock:
+            checks = list(self.checks.items())
+
+        success = []
+        duration = []
+        timestamp = []
+        values = []
+        for name, (result, d, t) in checks:
+            check = [("check", name)]
+            state = succeeded(result)
+            if state is not None:
+                success.append((check, int(state)))
+            duration.append((check, d))
+            timestamp.append((check, t))
+            for key, fields in flatten(result):
+                labels = check + ([key] if key else [])
+                for field in sorted(fields):
+                    values.append((labels + [("field", field)],
+                                   fields[field]))
+
+        lines = []
+        for metric, kind, doc, samples in [
+                ("check_success", "gauge",
+                 "Whether the last run of the check passed", success),
+                ("check_duration_seconds", "gauge",
+                 "Duration of the last run of the check", duration),
+                ("check_timestamp_seconds", "gauge",
+                 "Completion time of the last run of the check", timestamp),
+                ("check_value", "gauge",
+                 "Numeric fields of the last check results", values)]:
+            name = "%s_%s" % (PREFIX, metric)
+            lines.append("# HELP %s %s" % (name, doc))
+            lines.append("# TYPE %s %s" % (name, kind))
+            for labels, v in samples:
+                lines.append("%s{%s} %s" % (name, _labels(labels), repr(v)))
+
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        """
+        Atomically replace the metrics file so collectors never read a
+        partially written file.
+        """
+        tmp = "%s.tmp" % self.textfile
+        try:
+            with open(tmp, "w") as fh:
+                fh.write(self.render())
+            os.rename(tmp, self.textfile)
+        except IOError as i:
+            logger.error("Failed to write metrics to %s", self.textfile)
+            logger.error(str(i))
+
+    def close(self):
+        """
+        Stop serving the metrics.
+        """
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
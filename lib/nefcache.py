@@ -0,0 +1,214 @@
+"""
+nefcache.py
+
+Persistent cache of NEF GET responses.
+
+Responses of the large, rarely changing collections are stored on disk,
+keyed by API url, user, method and parameters, so later runs don't fetch
+them from scratch. Responses carrying an ETag or Last-Modified validator are
+revalidated with a conditional request, NEF answers 304 without a body if
+they are unchanged. Responses without a validator are used for a fixed TTL,
+except those of the collections carrying health state, i.e. pool and disk
+status, which are fetched again unless NEF can revalidate them.
+The cache is bounded in size, the least recently used entries are evicted.
+
+Copyright (c) 2016  Nexenta Systems
+William Kettler <william.kettler@nexenta.com>
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+# Methods whose responses are cached
+METHODS = (
+    "inventory/disks",
+    "storage/pools",
+    "rsf/clusters",
+    "network/routes",
+    "network/nameservers",
+    "services/smb"
+)
+
+# Cached methods whose responses carry health state and are never used
+# without revalidation
+HEALTH = (
+    "inventory/disks",
+    "storage/pools",
+    "rsf/clusters"
+)
+
+
+class ResponseCache(object):
+    """
+    On-disk NEF response cache, one JSON file per response. The file mtime
+    is the time of last use.
+
+    Attributes:
+        path (str): Cache directory
+        ttl (float): Seconds responses without validators are used for
+        max_bytes (int): Maximum total size of the cache files
+        methods (tuple): Cached API methods
+        health (tuple): Cached API methods never used without revalidation
+    """
+
+    def __init__(self, path, ttl=300, max_bytes=64 * 1024 * 1024,
+                 methods=METHODS, health=HEALTH):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.methods = methods
+        self.health = health
+        self._lock = threading.Lock()
+
+        if not os.path.isdir(path):
+            os.makedirs(path, 0o700)
+
+    def cacheable(self, method):
+        """
+        Return whether the responses of a method are cached.
+        """
+        return method in self.methods
+
+    @staticmethod
+    def key(url, username, method, params):
+        """
+        Return the cache key of a request.
+
+        Args:
+            url (str): API url
+            username (str): Username
+            method (str): NEF API method
+            params (dict): Request parameters
+        Returns:
+            The key as a str.
+        """
+        request = json.dumps([url, username, method, params],
+                             sort_keys=True)
+
+        return hashlib.sha1(request.encode("utf-8")).hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, "%s.json" % key)
+
+    def lookup(self, key):
+        """
+        Return a cached response.
+
+        Args:
+            key (str): Cache key
+        Returns:
+            A dict with the response "body", "etag", "last_modified" and the
+            "time" it was stored or validated, None on a miss.
+        """
+        try:
+            with open(self._file(key)) as fh:
+                return json.load(fh)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def storable(self, method, etag=None, last_modified=None):
+        """
+        Return whether a response of a method is worth storing, responses
+        carrying health state are only stored if they can be revalidated.
+        """
+        return bool(etag or last_modified) or method not in self.health
+
+    def fresh(self, method, entry):
+        """
+        Return whether an entry can be used without asking NEF, i.e. it has
+        no validator, is younger than the TTL and carries no health state.
+        """
+        if entry.get("etag") or entry.get("last_modified"):
+            return False
+        if method in self.health:
+            return False
+
+        return time.time() - entry["time"] < self.ttl
+
+    def touch(self, key):
+        """
+        Mark an entry as used.
+        """
+        try:
+            os.utime(self._file(key), None)
+        except OSError:
+            pass
+
+    def store(self, key, body, etag=None, last_modified=None):
+        """
+        Store a response and evict the least recently used entries if the
+        cache is too large.
+
+        Args:
+            key (str): Cache key
+            body (object): Response body
+        Kwargs:
+            etag (str): ETag response header
+            last_modified (str): Last-Modified response header
+        """
+        entry = {
+            "time": time.time(),
+            "etag": etag,
+            "last_modified": last_modified,
+            "body": body
+        }
+        f = self._file(key)
+        tmp = "%s.%d.%d" % (f, os.getpid(), threading.get_ident())
+
+        try:
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as fh:
+                json.dump(entry, fh)
+            os.replace(tmp, f)
+        except (IOError, OSError) as e:
+            logger.debug("Failed to cache the response: %s", str(e))
+            return
+
+        self._evict()
+
+    def _evict(self):
+        """
+        Remove the least recently used entries beyond the size limit.
+        """
+        with self._lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.path):
+                if not name.endswith(".json"):
+                    continue
+                f = os.path.join(self.path, name)
+                try:
+                    st = os.stat(f)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, f))
+                total += st.st_size
+
+            entries.sort()
+            while total > self.max_bytes and entries:
+                _, size, f = entries.pop(0)
+                try:
+                    os.remove(f)
+                except OSError:
+                    continue
+                logger.debug("Evicted %s", f)
+                total -= size
+
+    def clear(self):
+        """
+        Remove all entries.
+        """
+        with self._lock:
+            for name in os.listdir(self.path):
+                if name.endswith(".json"):
+                    try:
+                        os.remove(os.path.join(self.path, name))
+                    except OSError:
+                        pass
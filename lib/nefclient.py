@@ -8,31 +8,214 @@ William Kettler <william.kettler@nexenta.com>
 """
 
 
+import os
 import logging
+import threading
 import requests
 import json
+from lib.logs import Payload
 
 
 logger = logging.getLogger(__name__)
 
 
+class TokenCache(object):
+    """
+    Process-wide cache of NEF bearer tokens.
+
+    The cache is shared by all NEFClient instances and threads so a token
+    obtained by one client is reused by every other client talking to the
+    same API as the same user. If a path is defined the tokens are also
+    persisted to that file, with mode 0600, so back-to-back runs can reuse
+    them.
+
+    Attributes:
+        path (str): Optional path to the persistent token file
+    """
+
+    def __init__(self, path=None):
+        self.path = None
+        self._tokens = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+        if path is not None:
+            self.persist(path)
+
+    @staticmethod
+    def _key(url, username):
+        return "%s|%s" % (url, username)
+
+    def persist(self, path):
+        """
+        Persist the cache to a file and load any tokens already stored in it.
+
+        Args:
+            path (str): Path to the token file
+        """
+        try:
+            with open(path) as fh:
+                stored = json.load(fh)
+        except (IOError, OSError, ValueError) as e:
+            logger.debug("Not loading tokens from %s: %s", path, str(e))
+            stored = {}
+
+        if not isinstance(stored, dict):
+            logger.warning("Ignoring the token file %s, it does not hold "
+                           "an object", path)
+            stored = {}
+
+        with self._lock:
+            self.path = path
+            # Tokens obtained by this process take precedence
+            for k, v in stored.items():
+                self._tokens.setdefault(k, v)
+
+    def lock(self, url, username):
+        """
+        Return the lock serializing logins for a url and username.
+
+        Args:
+            url (str): API url
+            username (str): Username
+        Returns:
+            A threading.Lock.
+        """
+        key = self._key(url, username)
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def get(self, url, username):
+        """
+        Return the cached token or None.
+
+        Args:
+            url (str): API url
+            username (str): Username
+        Returns:
+            The bearer token.
+        """
+        with self._lock:
+            return self._tokens.get(self._key(url, username))
+
+    def set(self, url, username, token):
+        """
+        Cache a token.
+
+        Args:
+            url (str): API url
+            username (str): Username
+            token (str): Bearer token
+        """
+        with self._lock:
+            self._tokens[self._key(url, username)] = token
+            self._save()
+
+    def invalidate(self, url, username, token=None):
+        """
+        Remove a token from the cache.
+
+        If a token is provided it is only removed if it is still the cached
+        one, so a stale client can't drop a token another thread has just
+        refreshed.
+
+        Args:
+            url (str): API url
+            username (str): Username
+        Kwargs:
+            token (str): The token known to be invalid
+        """
+        key = self._key(url, username)
+        with self._lock:
+            if token is None or self._tokens.get(key) == token:
+                self._tokens.pop(key, None)
+                self._save()
+
+    def _save(self):
+        """
+        Write the tokens to the persistent file. The caller holds the lock.
+        """
+        if self.path is None:
+            return
+
+        tmp = "%s.%d" % (self.path, os.getpid())
+        try:
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as fh:
+                json.dump(self._tokens, fh)
+            os.rename(tmp, self.path)
+        except (IOError, OSError) as e:
+            logger.warning("Failed to save tokens to %s", self.path)
+            logger.debug(str(e), exc_info=True)
+
+
+# Shared by every NEFClient in the process
+tokens = TokenCache()
+
+# Optional persistent GET response cache, a lib.nefcache.ResponseCache
+cache = None
+
+# Per-thread HTTP sessions keeping connections to the API open
+_local = threading.local()
+
+# Endpoint and credentials used by clients created without any, i.e. by the
+# lib.config functions. Fleet mode points these at a remote appliance.
+defaults = {
+    "url": "http://localhost:8080",
+    "username": None,
+    "password": None
+}
+
+
+def _session():
+    """
+    Return the requests session of the calling thread.
+
+    Sessions keep the connections to the API alive between requests so long
+    running processes don't pay a TCP (and TLS) handshake per request. A
+    forked process creates its own session rather than sharing the parent's
+    connections.
+
+    Returns:
+        A requests.Session.
+    """
+    session = getattr(_local, "session", None)
+    if session is None or _local.pid != os.getpid():
+        session = requests.Session()
+        _local.session = session
+        _local.pid = os.getpid()
+
+    return session
+
+
 class NEFClient(object):
     """
     NEF REST API client.
 
     WARNING this class does not currently validate the SSL certificate.
 
+    Bearer tokens are shared through the process-wide token cache so only the
+    first client for a given url and username logs in. An expired token is
+    refreshed transparently, once, when a request is rejected with a 401.
+
     Attributes:
-        url (str): API url, i.e. https://<ip>
-        port (int): API port
+        url (str): API url, i.e. https://<ip>:<port>, defaults to the
+                   process-wide default endpoint
         username (str): Optional username, required if password provided
         password (str): Optional password, required if username provided
     """
 
-    def __init__(self):
-        self.url = "http://localhost:8080"
-        self.username = None
-        self.password = None
+    def __init__(self, url=None, username=None, password=None):
+        if url is None:
+            url = defaults["url"]
+            if username is None:
+                username = defaults["username"]
+            if password is None:
+                password = defaults["password"]
+
+        self.url = url
+        self.username = username
+        self.password = password
         self.key = None
         self.verify = False
         self.headers = {
@@ -50,9 +233,12 @@ class NEFClient(object):
         elif self.password is not None:
             raise TypeError("A username is required when password is provided")
 
-    def _login(self):
+    def _login(self, stale=None):
         """
-        Sends a login request.
+        Sends a login request unless a valid token is already cached.
+
+        Kwargs:
+            stale (str): Token rejected by the API which must not be reused
         """
         method = "auth/login"
         payload = {
@@ -60,21 +246,72 @@ class NEFClient(object):
             "password": self.password
         }
 
-        logger.debug("Logging in as user %s to %s", self.username, self.url)
-        try:
-            response = requests.post("/".join([self.url, method]),
-                                     data=payload, verify=self.verify)
-            response.raise_for_status()
-            body = response.json()
-        # Bookmark until I find out what error handling makes sense
-        except:
-            raise
-
-        logger.debug(body)
+        # Only one thread logs in, the others pick up the cached token
+        with tokens.lock(self.url, self.username):
+            key = tokens.get(self.url, self.username)
+            if key is not None and key != stale:
+                logger.debug("Using cached token for user %s on %s",
+                             self.username, self.url)
+                self._authorize(key)
+                return
+
+            logger.debug("Logging in as user %s to %s", self.username,
+                         self.url)
+            try:
+                response = _session().post("/".join([self.url, method]),
+                                           data=payload, verify=self.verify)
+                response.raise_for_status()
+                body = response.json()
+            # Bookmark until I find out what error handling makes sense
+            except:
+                raise
+
+            logger.debug("%s", Payload(body))
+
+            tokens.set(self.url, self.username, body["token"])
+            self._authorize(body["token"])
+
+    def _authorize(self, key):
+        """
+        Use a bearer token for all following requests.
 
-        self.key = body["token"]
+        Args:
+            key (str): Bearer token
+        """
+        self.key = key
         self.headers["Authorization"] = "Bearer %s" % self.key
 
+    def _send(self, verb, method, headers=None, **kwargs):
+        """
+        Sends a request and logs in again once if the token was rejected.
+
+        Args:
+            verb (str): HTTP verb, i.e. get
+            method (str): NEF API method
+        Kwargs:
+            headers (dict): Additional request headers
+            Passed to the requests session method
+        Returns:
+            The response object.
+        """
+        func = getattr(_session(), verb)
+        url = "/".join([self.url, method])
+        response = func(url, headers=dict(self.headers, **(headers or {})),
+                        verify=self.verify, **kwargs)
+
+        # The token has most likely expired
+        if response.status_code == 401 and self.username is not None:
+            logger.debug("Token rejected by %s, logging in again", self.url)
+            tokens.invalidate(self.url, self.username, token=self.key)
+            self._login(stale=self.key)
+            response = func(url,
+                            headers=dict(self.headers, **(headers or {})),
+                            verify=self.verify, **kwargs)
+
+        response.raise_for_status()
+
+        return response
+
     def logout(self):
         """
         Sends logout request.
@@ -82,6 +319,7 @@ class NEFClient(object):
         method = "auth/logout"
         logger.debug("Logging out as user %s on %s", self.username, self.url)
         self.post(method)
+        tokens.invalidate(self.url, self.username, token=self.key)
 
     def get(self, method, params=None):
         """
@@ -95,23 +333,50 @@ class NEFClient(object):
             The HTML response body as a dict.
         """
         logger.debug("GET %s", method)
-        logger.debug(params)
+        logger.debug("%s", Payload(params))
+
+        # Use or revalidate a cached response
+        key = entry = None
+        headers = {}
+        if cache is not None and cache.cacheable(method):
+            key = cache.key(self.url, self.username, method, params)
+            entry = cache.lookup(key)
+        if entry is not None:
+            if cache.fresh(method, entry):
+                logger.debug("Using cached response")
+                cache.touch(key)
+                return entry["body"]
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
         try:
-            response = requests.get("/".join([self.url, method]),
-                                    headers=self.headers, verify=self.verify,
-                                    params=params)
-            response.raise_for_status()
+            response = self._send("get", method, params=params,
+                                  headers=headers)
         # Bookmark until I find out what error handling makes sense
         except:
             raise
 
+        if entry is not None and response.status_code == 304:
+            logger.debug("Cached response is still valid")
+            cache.touch(key)
+            return entry["body"]
+
         # If there is no response body json() will fail
         try:
             body = response.json()
         except ValueError:
             body = None
 
-        logger.debug(body)
+        logger.debug("%s", Payload(body))
+
+        if key is not None and response.status_code == 200:
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+            if cache.storable(method, etag, last_modified):
+                cache.store(key, body, etag=etag,
+                            last_modified=last_modified)
 
         return body
 
@@ -127,12 +392,9 @@ class NEFClient(object):
             The job ID if the request is ASYNC otherwise None.
         """
         logger.debug("POST %s", method)
-        logger.debug(payload)
+        logger.debug("%s", Payload(payload))
         try:
-            response = requests.post("/".join([self.url, method]),
-                                     headers=self.headers, verify=self.verify,
-                                     data=json.dumps(payload))
-            response.raise_for_status()
+            response = self._send("post", method, data=json.dumps(payload))
         # Bookmark until I find out what error handling makes sense
         except:
             raise
@@ -149,7 +411,7 @@ class NEFClient(object):
         else:
             jobid = None
 
-        logger.debug(body)
+        logger.debug("%s", Payload(body))
 
         return jobid
 
@@ -165,12 +427,9 @@ class NEFClient(object):
             The job ID if the request is ASYNC otherwise None.
         """
         logger.debug("PUT %s", method)
-        logger.debug(payload)
+        logger.debug("%s", Payload(payload))
         try:
-            response = requests.put("/".join([self.url, method]),
-                                    headers=self.headers, verify=self.verify,
-                                    data=json.dumps(payload))
-            response.raise_for_status()
+            response = self._send("put", method, data=json.dumps(payload))
         # Bookmark until I find out what error handling makes sense
         except:
             raise
@@ -187,7 +446,7 @@ class NEFClient(object):
         else:
             jobid = None
 
-        logger.debug(body)
+        logger.debug("%s", Payload(body))
 
         return jobid
 
@@ -203,13 +462,9 @@ class NEFClient(object):
             The job ID if the request is ASYNC otherwise None.
         """
         logger.debug("DELETE %s", method)
-        logger.debug(payload)
+        logger.debug("%s", Payload(payload))
         try:
-            response = requests.delete("/".join([self.url, method]),
-                                       headers=self.headers,
-                                       verify=self.verify,
-                                       data=json.dumps(payload))
-            response.raise_for_status()
+            response = self._send("delete", method, data=json.dumps(payload))
         # Bookmark until I find out what error handling makes sense
         except:
             raise
@@ -226,7 +481,7 @@ class NEFClient(object):
         else:
             jobid = None
 
-        logger.debug(body)
+        logger.debug("%s", Payload(body))
 
         return jobid
 
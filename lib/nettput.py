@@ -0,0 +1,247 @@
+"""
+nettput.py
+
+Network throughput test.
+
+The client streams data over parallel TCP connections to a server which
+counts the bytes received and acknowledges the count when the client shuts
+its side down. Data is sent with zero-copy sendfile from a temporary file,
+in buffer sized chunks, so stalls of a stream can be detected from the time
+each chunk takes. On Linux the retransmits of each stream are read from
+TCP_INFO.
+
+Copyright (c) 2016  Nexenta Systems
+William Kettler <william.kettler@nexenta.com>
+"""
+
+import os
+import time
+import array
+import socket
+import struct
+import logging
+import tempfile
+import threading
+import socketserver
+from lib.stats import median
+
+
+logger = logging.getLogger(__name__)
+
+# Default server port
+PORT = 5205
+
+# Socket buffer size requested on both ends
+SOCKBUF = 4 * 1024 * 1024
+
+# Offset and format of tcpi_total_retrans in the Linux struct tcp_info
+TCP_INFO_RETRANS = (100, "I")
+
+# Byte count acknowledged by the server
+ACK = struct.Struct("!Q")
+
+
+def _tune(sock):
+    """
+    Request large socket buffers and disable Nagle.
+    """
+    for opt in (socket.SO_SNDBUF, socket.SO_RCVBUF):
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, opt, SOCKBUF)
+        except OSError:
+            pass
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+def retransmits(sock):
+    """
+    Return the total retransmits of a TCP connection or None if the platform
+    doesn't provide TCP_INFO.
+    """
+    opt = getattr(socket, "TCP_INFO", None)
+    if opt is None:
+        return None
+
+    offset, fmt = TCP_INFO_RETRANS
+    size = offset + struct.calcsize(fmt)
+    try:
+        info = sock.getsockopt(socket.IPPROTO_TCP, opt, size)
+    except OSError:
+        return None
+    if len(info) < size:
+        return None
+
+    return struct.unpack_from(fmt, info, offset)[0]
+
+
+def _sendfile(sock, fh, count):
+    """
+    Send count bytes of a file, zero-copy where supported.
+    """
+    if hasattr(sock, "sendfile"):
+        return sock.sendfile(fh, 0, count)
+
+    sent = 0
+    while sent < count:
+        sent += os.sendfile(sock.fileno(), fh.fileno(), sent, count - sent)
+
+    return sent
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    """
+    Count the bytes of a stream and acknowledge the count on EOF.
+    """
+
+    def handle(self):
+        buf = bytearray(self.server.buf)
+        received = 0
+        while True:
+            n = self.request.recv_into(buf)
+            if not n:
+                break
+            received += n
+        self.request.sendall(ACK.pack(received))
+        logger.debug("Received %d bytes from %s", received,
+                     self.client_address[0])
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """
+    Throughput test server, each stream is handled by its own thread.
+
+    Attributes:
+        buf (int): Receive buffer size in bytes
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=("", PORT), buf=1024 * 1024):
+        self.buf = buf
+        socketserver.TCPServer.__init__(self, address, _Handler,
+                                        bind_and_activate=False)
+        _tune(self.socket)
+        self.server_bind()
+        self.server_activate()
+
+    def start(self):
+        """
+        Serve in a background thread.
+        """
+        t = threading.Thread(target=self.serve_forever)
+        t.daemon = True
+        t.start()
+
+
+def _stream(host, port, fh, buf, duration, stall, timeout):
+    """
+    Send data over a single connection for the duration.
+
+    Returns:
+        The stream results.
+    """
+    chunks = array.array("d")
+    sock = socket.create_connection((host, port), timeout=timeout)
+    try:
+        _tune(sock)
+        start = time.time()
+        deadline = start + duration
+        sent = 0
+        while True:
+            t = time.time()
+            if t >= deadline:
+                break
+            sent += _sendfile(sock, fh, buf)
+            chunks.append(time.time() - t)
+        sock.shutdown(socket.SHUT_WR)
+
+        # The server acknowledges once everything was received
+        ack = b""
+        while len(ack) < ACK.size:
+            data = sock.recv(ACK.size - len(ack))
+            if not data:
+                raise RuntimeError("The server closed the connection")
+            ack += data
+        seconds = time.time() - start
+        received = ACK.unpack(ack)[0]
+        retrans = retransmits(sock)
+    finally:
+        sock.close()
+
+    if received != sent:
+        raise RuntimeError("Sent %d bytes but the server received %d" %
+                           (sent, received))
+
+    # A chunk taking much longer than usual was held up, i.e. waiting for a
+    # retransmit timeout
+    threshold = max(stall, 4 * (median(chunks) or 0))
+
+    return {
+        "bytes": received,
+        "seconds": round(seconds, 3),
+        "gbps": round(received * 8 / seconds / 1e9, 3),
+        "stalls": sum(1 for c in chunks if c > threshold),
+        "retransmits": retrans
+    }
+
+
+def measure(host, port=PORT, streams=4, duration=5, buf=1024 * 1024,
+            stall=0.2, timeout=10):
+    """
+    Measure the throughput to a server.
+
+    Args:
+        host (str): Server address
+    Kwargs:
+        port (int): Server port
+        streams (int): Number of parallel connections
+        duration (float): Send duration in seconds
+        buf (int): Bytes sent per sendfile call
+        stall (float): Minimum chunk time in seconds counted as a stall
+        timeout (float): Connect and acknowledgement timeout in seconds
+    Returns:
+        A dict with the aggregate "gbps", "bytes", "stalls" and
+        "retransmits" and the per stream results in "streams".
+    """
+    results = [None] * streams
+    errors = []
+
+    def worker(i):
+        try:
+            results[i] = _stream(host, port, fh, buf, duration, stall,
+                                 timeout)
+        # Report any failure of a stream thread to the caller
+        except Exception as e:
+            logger.debug(str(e), exc_info=True)
+            errors.append(str(e))
+
+    with tempfile.TemporaryFile() as fh:
+        fh.write(os.urandom(buf))
+        fh.flush()
+
+        thrs = []
+        for i in range(streams):
+            t = threading.Thread(target=worker, args=(i,))
+            t.start()
+            thrs.append(t)
+        for t in thrs:
+            t.join()
+
+    if errors:
+        raise RuntimeError(errors[0])
+
+    seconds = max(r["seconds"] for r in results)
+    total = sum(r["bytes"] for r in results)
+    retrans = [r["retransmits"] for r in results]
+    for i, r in enumerate(results):
+        r["stream"] = i
+
+    return {
+        "bytes": total,
+        "seconds": seconds,
+        "gbps": round(total * 8 / seconds / 1e9, 3),
+        "stalls": sum(r["stalls"] for r in results),
+        "retransmits": None if None in retrans else sum(retrans),
+        "streams": results
+    }
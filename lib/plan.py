@@ -0,0 +1,241 @@
+"""
+plan.py
+
+Estimate how long the checks take and order them to minimize the wall time.
+
+A check's duration is taken from the timings recorded by the previous run if
+available, otherwise it is estimated from its config and the appliance, i.e.
+the number of disks, RSF services or nameservers. An "estimate" (seconds) in
+the check config overrides both.
+
+Copyright (c) 2016  Nexenta Systems
+William Kettler <william.kettler@nexenta.com>
+"""
+
+import math
+import heapq
+import logging
+import lib.config as config
+import lib.results as results
+from lib.runner import get_check
+from lib.progress import fmt_duration
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds per ping, pings are sent once a second
+PING = 1
+
+# Seconds to move a single RSF service including the job polling
+RSF_MOVE = 60
+
+# Seconds of checks without a better estimate
+DEFAULT = 10
+
+
+def _count(getter):
+    """
+    Return the number of objects returned by a config getter or 1 if the
+    appliance can't be queried.
+    """
+    try:
+        return len(getter())
+    # The plan must not fail because the appliance is unreachable
+    except Exception as e:
+        logger.debug(str(e), exc_info=True)
+        return 1
+
+
+def _services():
+    """
+    Return the RSF services.
+    """
+    return config.get_rsf()[2]
+
+
+def _dns_ping(args, kwargs):
+    """
+    The nameservers are pinged one after the other.
+    """
+    return PING * kwargs.get("count", 5) * _count(config.get_nameservers)
+
+
+def _disk_perf(args, kwargs):
+    """
+    Disks are tested by a pool of workers, converging tests are bounded by
+    max_duration.
+    """
+    if kwargs.get("disks") is not None:
+        disks = len(kwargs["disks"])
+    else:
+        disks = _count(config.get_disks)
+    workers = max(1, kwargs.get("workers", 8))
+    if kwargs.get("precision") is None or \
+            kwargs.get("engine", "dd") != "dd":
+        per_disk = kwargs.get("duration", 5)
+    else:
+        per_disk = kwargs.get("max_duration", 30)
+
+    return math.ceil(disks / float(workers)) * per_disk
+
+
+def _rsf_failover(args, kwargs):
+    """
+    Every round moves each service to the partner and back.
+    """
+    return 2 * kwargs.get("rounds", 3) * RSF_MOVE * _count(_services)
+
+
+def _pool_write(args, kwargs):
+    """
+    Every combination is bounded by the duration.
+    """
+    if kwargs.get("directory") is not None:
+        targets = 1
+    else:
+        pools = kwargs.get("pools")
+        targets = (len(pools) if pools else _count(config.get_pools)) * \
+            len(kwargs.get("recordsizes", ["128K"]))
+    combinations = len(kwargs.get("block_sizes", [4, 128])) * \
+        len(kwargs.get("patterns", ["seq", "rand"])) * \
+        len(kwargs.get("syncs", ["dsync", "none"]))
+
+    return targets * combinations * kwargs.get("duration", 10)
+
+
+def _vdev_iostat(args, kwargs):
+    """
+    The first iostat report is skipped.
+    """
+    return kwargs.get("interval", 1) * (kwargs.get("samples", 10) + 1)
+
+
+# Config based estimators by check function, called with the check args and
+# kwargs
+ESTIMATORS = {
+    "check_ping": lambda a, k: PING * k.get("count", 5),
+    "check_gateway_ping": lambda a, k: PING * k.get("count", 5),
+    "check_domain_ping": lambda a, k: PING * k.get("count", 5),
+    "check_dns_ping": _dns_ping,
+    "check_dns_lookup": lambda a, k: 1,
+    "check_zpool_status": lambda a, k: 1,
+    "check_metadata_blocks": lambda a, k: 1,
+    "check_tunables": lambda a, k: 1,
+    "check_time_delta": lambda a, k: k.get("timeout", 2) + 1,
+    "check_cmd": lambda a, k: k.get("timeout") or DEFAULT,
+    "check_rsf_move": lambda a, k: RSF_MOVE * _count(_services),
+    "check_rsf_failover": _rsf_failover,
+    "check_rsf_tput": lambda a, k: k.get("duration", 5) + 1,
+    "check_vdev_iostat": _vdev_iostat,
+    "check_scan": lambda a, k: k.get("window", 10),
+    "check_arc": lambda a, k: k.get("window", 10),
+    "check_disk_perf": _disk_perf,
+    "check_pool_write": _pool_write
+}
+
+
+def history(path, profile="full"):
+    """
+    Return the check durations recorded in a previous result file.
+
+    Args:
+        path (str): Path to the result file
+    Kwargs:
+        profile (str): Only use the timings of a run of this profile
+    Returns:
+        A dict of durations in seconds keyed by check name.
+    """
+    durations = {}
+
+    try:
+        with results.load(path) as r:
+            ran = (r.header.get("profile") or {}).get("name", "full")
+            if ran != profile:
+                logger.debug("Ignoring the timings of a %s run", ran)
+                return durations
+            for name, entry in r.items():
+                if isinstance(entry, dict) and "duration" in entry:
+                    durations[name] = entry["duration"]
+    except (IOError, OSError, ValueError) as e:
+        logger.debug("No timings from %s: %s", path, str(e))
+
+    return durations
+
+
+def estimate(c, past=None):
+    """
+    Estimate the duration of a configured check.
+
+    Args:
+        c (dict): Configured check
+    Kwargs:
+        past (dict): Durations of a previous run keyed by check name
+    Returns:
+        A (seconds, basis) tuple, basis is "config", "history" or "default".
+    """
+    if "estimate" in c:
+        return float(c["estimate"]), "config"
+    if past and c["name"] in past:
+        return float(past[c["name"]]), "history"
+    if c["f"] in ESTIMATORS:
+        return float(ESTIMATORS[c["f"]](c["args"], c["kwargs"])), "config"
+
+    return float(DEFAULT), "default"
+
+
+def schedule(checks, estimates, jobs=1):
+    """
+    Split the checks into stages and order each stage longest first.
+
+    Disruptive checks run alone in their own stage, in their configured
+    position, so they never overlap other checks. The checks between them
+    form a stage run by the given number of jobs. Handing the longest check
+    to the first idle job (LPT) keeps the stage's makespan within 4/3 of the
+    optimum. With a single job the configured order is kept.
+
+    Args:
+        checks (list): Enabled configured checks
+        estimates (dict): Estimated durations keyed by check name
+    Kwargs:
+        jobs (int): Number of checks run at the same time
+    Returns:
+        A list of stages, each a dict with the ordered "checks", the "jobs"
+        running them and the estimated "makespan" in seconds.
+    """
+    stages = []
+    current = []
+
+    def close():
+        if not current:
+            return
+        n = max(1, min(jobs, len(current)))
+        ordered = list(current)
+        if n > 1:
+            ordered.sort(key=lambda c: estimates.get(c["name"], 0),
+                         reverse=True)
+        # Simulate the jobs picking the checks in order
+        load = [0.0] * n
+        for c in ordered:
+            heapq.heapreplace(load, load[0] + estimates.get(c["name"], 0))
+        stages.append({
+            "checks": ordered,
+            "jobs": n,
+            "makespan": max(load)
+        })
+        del current[:]
+
+    for c in checks:
+        try:
+            exclusive = getattr(get_check(c), "disruptive", False)
+        except RuntimeError:
+            # Let the runner record the missing function
+            exclusive = False
+        if exclusive:
+            close()
+            current.append(c)
+            close()
+        else:
+            current.append(c)
+    close()
+
+    return stages
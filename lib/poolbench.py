@@ -0,0 +1,188 @@
+"""
+poolbench.py
+
+File system write benchmark.
+
+Files are written through the file system, as clients see it, rather than
+to the raw devices. Each write of a preallocated buffer is timed so the
+throughput and the latency distribution are reported, with the writes
+synchronized by O_DSYNC, an fsync per write or only a final fsync.
+
+Benchmarks run in a temporary ZFS dataset, which allows sweeping the
+recordsize, or a temporary directory and are cleaned up afterwards.
+
+Copyright (c) 2016  Nexenta Systems
+William Kettler <william.kettler@nexenta.com>
+"""
+
+import os
+import re
+import array
+import random
+import shutil
+import logging
+import tempfile
+from time import perf_counter
+from contextlib import contextmanager
+from lib.stats import percentile
+from lib.execute import execute, RetcodeError
+
+
+logger = logging.getLogger(__name__)
+
+# Write patterns and synchronization modes
+PATTERNS = ("seq", "rand")
+SYNCS = ("dsync", "fsync", "none")
+
+# Valid ZFS recordsize values, they are passed to the shell
+RECORDSIZE = re.compile(r"^\d+[KkMm]?$")
+
+
+@contextmanager
+def dataset(pool, recordsize=None):
+    """
+    Create a temporary dataset and destroy it on exit.
+
+    Args:
+        pool (str): Pool name
+    Kwargs:
+        recordsize (str): Dataset recordsize, i.e. "128K"
+    Yields:
+        The dataset mountpoint.
+    """
+    name = "%s/autosac-bench-%d" % (pool, os.getpid())
+    opts = ""
+    if recordsize is not None:
+        if not RECORDSIZE.match(str(recordsize)):
+            raise ValueError("Invalid recordsize %s" % recordsize)
+        opts = " -o recordsize=%s" % recordsize
+
+    execute("zfs create%s %s" % (opts, name), timeout=60)
+    try:
+        yield execute("zfs get -H -o value mountpoint %s" % name,
+                      timeout=60).strip()
+    finally:
+        try:
+            execute("zfs destroy -r %s" % name, timeout=300)
+        except RetcodeError as r:
+            logger.error("Failed to destroy the dataset %s", name)
+            logger.debug("%s", r.output)
+
+
+@contextmanager
+def directory(path):
+    """
+    Create a temporary directory and remove it on exit.
+
+    Args:
+        path (str): Parent directory
+    Yields:
+        The temporary directory.
+    """
+    tmp = tempfile.mkdtemp(prefix="autosac-bench-", dir=path)
+    try:
+        yield tmp
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def write(path, bs, size, pattern="seq", sync="dsync", duration=None):
+    """
+    Write a file and time every write. The file is removed afterwards.
+
+    Args:
+        path (str): File path
+        bs (int): Block size in bytes
+        size (int): File size in bytes
+    Kwargs:
+        pattern (str): "seq" or "rand" block order
+        sync (str): "dsync" opens the file O_DSYNC, "fsync" syncs after
+                    every write and "none" syncs once at the end
+        duration (float): Stop after this many seconds
+    Returns:
+        A dict with the bytes written, "mbps" throughput in MB/s of 1024^2
+        bytes, as check_disk_perf, the number of writes and the p50, p95,
+        p99 and max write latency in ms.
+    """
+    if pattern not in PATTERNS or sync not in SYNCS:
+        raise ValueError("Unsupported pattern %s or sync %s" % (pattern, sync))
+
+    # Everything is allocated before the clock starts, random data avoids
+    # compression
+    buf = memoryview(os.urandom(bs))
+    blocks = max(1, size // bs)
+    offsets = None
+    if pattern == "rand":
+        offsets = array.array("q", range(blocks))
+        random.shuffle(offsets)
+    latency = array.array("d")
+
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+    if sync == "dsync":
+        flags |= os.O_DSYNC
+
+    fd = os.open(path, flags, 0o600)
+    try:
+        if offsets is not None:
+            os.ftruncate(fd, blocks * bs)
+        start = perf_counter()
+        deadline = start + duration if duration else None
+        for i in range(blocks):
+            t = perf_counter()
+            if offsets is None:
+                os.write(fd, buf)
+            else:
+                os.pwrite(fd, buf, offsets[i] * bs)
+            if sync == "fsync":
+                os.fsync(fd)
+            done = perf_counter()
+            latency.append(done - t)
+            if deadline is not None and done >= deadline:
+                break
+        if sync == "none":
+            os.fsync(fd)
+        elapsed = perf_counter() - start
+    finally:
+        os.close(fd)
+        os.unlink(path)
+
+    written = len(latency) * bs
+    ordered = sorted(latency)
+
+    return {
+        "bytes": written,
+        "mbps": round(written / elapsed / 1024 ** 2, 3),
+        "writes": len(latency),
+        "p50": round(percentile(ordered, 50) * 1000, 3),
+        "p95": round(percentile(ordered, 95) * 1000, 3),
+        "p99": round(percentile(ordered, 99) * 1000, 3),
+        "max": round(ordered[-1] * 1000, 3)
+    }
+
+
+def sweep(path, block_sizes, patterns=PATTERNS, syncs=("dsync", "none"),
+          size=256 * 1024 * 1024, duration=10):
+    """
+    Run the write benchmark for every combination of block size, pattern
+    and sync mode.
+
+    Args:
+        path (str): Directory to write in
+        block_sizes (list): Block sizes in bytes
+    Kwargs:
+        patterns (list): Write patterns
+        syncs (list): Synchronization modes
+        size (int): Maximum bytes written per combination
+        duration (float): Maximum seconds per combination
+    Returns:
+        A generator of (bs, pattern, sync, results) tuples.
+    """
+    f = os.path.join(path, "autosac-bench.dat")
+
+    for bs in block_sizes:
+        for pattern in patterns:
+            for sync in syncs:
+                logger.debug("Writing %s %s %s bytes in %s", pattern, sync,
+                             bs, path)
+                yield bs, pattern, sync, write(f, bs, size, pattern=pattern,
+                                               sync=sync, duration=duration)
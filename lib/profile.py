@@ -0,0 +1,219 @@
+"""
+profile.py
+
+Run profiles trading coverage for run time.
+
+The full profile runs the checks as configured. The quick profile is a
+pre-flight pass: it shortens the durations and ping counts, benchmarks a
+stratified sample of the disks, at least one disk per model, controller and
+pool, and skips the disruptive checks it has no cheaper variant of. What was
+skipped and sampled is recorded so the full profile can be run later.
+
+Copyright (c) 2016  Nexenta Systems
+William Kettler <william.kettler@nexenta.com>
+"""
+
+import re
+import logging
+import lib.config as config
+from lib.execute import execute, RetcodeError, TimeoutError
+from lib.runner import get_check
+
+
+logger = logging.getLogger(__name__)
+
+# Check kwargs overridden by each profile, keyed by check function
+PROFILES = {
+    "full": {},
+    "quick": {
+        "check_ping": {"count": 2},
+        "check_gateway_ping": {"count": 2},
+        "check_dns_ping": {"count": 2},
+        "check_domain_ping": {"count": 2},
+        "check_time_delta": {"samples": 2},
+        "check_vdev_iostat": {"samples": 3},
+        "check_scan": {"window": 3},
+        "check_arc": {"window": 3},
+        "check_disk_perf": {
+            "duration": 2,
+            "precision": 0.10,
+            "min_duration": 1,
+            "max_duration": 5
+        }
+    }
+}
+
+# Disk fields holding the model, in order of preference
+MODEL_FIELDS = ("model", "productId", "product")
+
+# Disk device names, i.e. c0t5000C500A1B2C3D4d0, and their controller
+DISK = re.compile(r"^(c\d+)(t[0-9A-Fa-f]+)?d\d+")
+
+
+def zpool_status():
+    """
+    Return the zpool status output.
+    """
+    return execute("zpool status", timeout=60)
+
+
+def pool_members(source=zpool_status):
+    """
+    Map the disks to their pools from the zpool status output.
+
+    Kwargs:
+        source (function): Returns the zpool status output
+    Returns:
+        A dict of pool names keyed by disk.
+    """
+    members = {}
+    pool = None
+
+    for line in source().splitlines():
+        fields = line.split()
+        if not fields:
+            continue
+        if fields[0] == "pool:" and len(fields) > 1:
+            pool = fields[1]
+            continue
+        m = DISK.match(fields[0])
+        if pool is not None and m is not None:
+            members[m.group(0)] = pool
+
+    return members
+
+
+def _strata(disk, members):
+    """
+    Return the strata a disk belongs to as (dimension, value) tuples.
+    """
+    name = disk["logicalDevice"]
+    strata = []
+
+    for f in MODEL_FIELDS:
+        if disk.get(f):
+            strata.append(("model", disk[f]))
+            break
+
+    m = DISK.match(name)
+    if m is not None:
+        strata.append(("controller", m.group(1)))
+
+    pool = members.get(name, disk.get("pool"))
+    if pool:
+        strata.append(("pool", pool))
+
+    return strata
+
+
+def sample_disks(disks, members=None):
+    """
+    Select the fewest disks covering every model, controller and pool.
+
+    Disks are picked greedily by the number of strata not yet covered, ties
+    are broken by device name so the sample is stable between runs.
+
+    Args:
+        disks (list): Disks as returned by config.get_disks()
+    Kwargs:
+        members (dict): Pool names keyed by disk
+    Returns:
+        A dict with the sampled "disks", the total number of disks "of" and
+        the covered "strata" values by dimension.
+    """
+    members = members or {}
+    strata = dict((d["logicalDevice"], set(_strata(d, members)))
+                  for d in disks)
+    uncovered = set()
+    for s in strata.values():
+        uncovered |= s
+
+    covered = {"model": [], "controller": [], "pool": []}
+    sampled = []
+    names = sorted(strata)
+    while uncovered:
+        best = max(names, key=lambda n: len(strata[n] & uncovered))
+        for dimension, value in sorted(strata[best] & uncovered):
+            covered[dimension].append(value)
+        uncovered -= strata[best]
+        sampled.append(best)
+
+    # Disks without any known strata are still represented
+    if not sampled and names:
+        sampled.append(names[0])
+
+    return {
+        "disks": sampled,
+        "of": len(disks),
+        "strata": dict((k, sorted(v)) for k, v in covered.items())
+    }
+
+
+def apply(checks, name):
+    """
+    Apply a profile to the configured checks.
+
+    Args:
+        checks (list): Enabled configured checks
+        name (str): Profile name
+    Returns:
+        A (checks, info) tuple. The checks are copies with the profile's
+        kwargs, info records the skipped checks and the sampled disks and is
+        None for the full profile.
+    """
+    try:
+        overrides = PROFILES[name]
+    except KeyError:
+        raise RuntimeError("Unknown profile '%s'" % name)
+
+    if not overrides:
+        return checks, None
+
+    info = {
+        "name": name,
+        "skipped": [],
+        "sampled": {}
+    }
+    profiled = []
+
+    for c in checks:
+        try:
+            disruptive = getattr(get_check(c), "disruptive", False)
+        except RuntimeError:
+            # Let the runner record the missing function
+            profiled.append(c)
+            continue
+
+        if disruptive and c["f"] not in overrides:
+            logger.warning("Check %s is disruptive and skipped by the %s "
+                           "profile", c["name"].upper(), name)
+            info["skipped"].append(c["name"])
+            continue
+
+        kwargs = dict(c["kwargs"])
+        kwargs.update(overrides.get(c["f"], {}))
+
+        if c["f"] == "check_disk_perf" and kwargs.get("disks") is None:
+            try:
+                disks = config.get_disks()
+            except RuntimeError as r:
+                logger.error(str(r))
+                disks = []
+            try:
+                members = pool_members()
+            except (RetcodeError, TimeoutError) as e:
+                logger.debug(str(e), exc_info=True)
+                members = {}
+            if disks:
+                sampled = sample_disks(disks, members)
+                logger.info("Check %s samples %d of %d disks",
+                            c["name"].upper(), len(sampled["disks"]),
+                            sampled["of"])
+                kwargs["disks"] = sampled["disks"]
+                info["sampled"][c["name"]] = sampled
+
+        c = dict(c)
+        c["kwargs"] = kwargs
+        profiled.append(c)
+
+    return profiled, info
@@ -0,0 +1,241 @@
+"""
+progress.py
+
+Progress reporting for long running checks.
+
+Checks update a Progress with the items done, a rate or the fraction
+reported by a job and it estimates the time remaining. Updates only store
+the values and compare the clock against the next report, so they are cheap
+enough to call from the benchmark loops. If the console log handler writes
+to a terminal the progress is a status line on that terminal, redrawn at
+most every TTY_INTERVAL seconds, otherwise it is logged every LOG_INTERVAL
+seconds. The console handler's stream clears the status line before a log
+record is written, under the handler lock the status line is drawn with.
+
+Copyright (c) 2016  Nexenta Systems
+William Kettler <william.kettler@nexenta.com>
+"""
+
+import math
+import logging
+import threading
+import lib.logs as logs
+from time import monotonic
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds between reports on a terminal and in the log
+TTY_INTERVAL = 0.5
+LOG_INTERVAL = 30
+
+
+def fmt_duration(seconds):
+    """
+    Format a duration, i.e. "1h 2m 5s".
+    """
+    seconds = int(math.ceil(seconds))
+    h, rest = divmod(seconds, 3600)
+    m, s = divmod(rest, 60)
+    if h:
+        return "%dh %dm %ds" % (h, m, s)
+    if m:
+        return "%dm %ds" % (m, s)
+
+    return "%ds" % s
+
+
+class _Console(object):
+    """
+    Console handler stream clearing the status line before log output.
+
+    Attributes:
+        stream (file): The terminal
+        shown (bool): Whether a status line is shown
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.shown = False
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def write(self, s):
+        if self.shown and s:
+            self.stream.write("\r\x1b[K")
+            self.shown = False
+        return self.stream.write(s)
+
+    def status(self, line):
+        """
+        Draw the status line.
+        """
+        self.stream.write("\r%s\x1b[K" % line)
+        self.stream.flush()
+        self.shown = True
+
+    def clear(self):
+        """
+        Clear the status line.
+        """
+        if self.shown:
+            self.stream.write("\r\x1b[K")
+            self.stream.flush()
+            self.shown = False
+
+
+def _console():
+    """
+    Return the console log handler if it writes to a terminal, with its
+    stream wrapped by _Console, otherwise None.
+    """
+    for h in logs.handlers():
+        if not isinstance(h, logging.StreamHandler) or \
+                isinstance(h, logging.FileHandler):
+            continue
+        try:
+            tty = h.stream.isatty()
+        except (AttributeError, ValueError):
+            continue
+        if not tty:
+            continue
+        h.acquire()
+        try:
+            if not isinstance(h.stream, _Console):
+                h.stream = _Console(h.stream)
+        finally:
+            h.release()
+        return h
+
+    return None
+
+
+class Progress(object):
+    """
+    Progress of a check.
+
+    Attributes:
+        name (str): Name shown in the reports
+        total (int): Number of items, None if unknown
+        unit (str): Item name, i.e. "disks"
+        done (int): Items done
+        fraction (float): Fraction done reported by a job, 0 to 1, used
+                          instead of done/total when set
+        rate (float): Current throughput in MB/s
+    """
+
+    def __init__(self, name, total=None, unit="items", interval=None):
+        self.name = name
+        self.total = total
+        self.unit = unit
+        self.done = 0
+        self.fraction = None
+        self.rate = None
+        self._console = _console()
+        self.tty = self._console is not None
+        if interval is None:
+            interval = TTY_INTERVAL if self.tty else LOG_INTERVAL
+        self.interval = interval
+        self.start = monotonic()
+        self._next = self.start + interval
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def update(self, done=None, fraction=None, rate=None):
+        """
+        Update the progress and report it if due.
+
+        Kwargs:
+            done (int): Items done
+            fraction (float): Fraction done, 0 to 1
+            rate (float): Current throughput in MB/s
+        """
+        if done is not None:
+            self.done = done
+        if fraction is not None:
+            self.fraction = fraction
+        if rate is not None:
+            self.rate = rate
+        if monotonic() >= self._next:
+            self._report()
+
+    def advance(self, n=1, rate=None):
+        """
+        Mark items done, safe to call from several threads.
+
+        Kwargs:
+            n (int): Number of items done
+            rate (float): Current throughput in MB/s
+        """
+        with self._lock:
+            self.done += n
+        self.update(rate=rate)
+
+    def eta(self):
+        """
+        Return the estimated seconds remaining, None if unknown.
+        """
+        fraction = self.fraction
+        if fraction is None and self.total:
+            fraction = self.done / float(self.total)
+        if not fraction:
+            return None
+
+        elapsed = monotonic() - self.start
+
+        return max(0.0, elapsed * (1 - fraction) / fraction)
+
+    def line(self):
+        """
+        Return the progress as text.
+        """
+        parts = []
+        if self.total is not None:
+            parts.append("%d/%d %s" % (self.done, self.total, self.unit))
+        if self.fraction is not None:
+            parts.append("%d%%" % (self.fraction * 100))
+        if self.rate is not None:
+            parts.append("%.1f MB/s" % self.rate)
+        parts.append("%s elapsed" % fmt_duration(monotonic() - self.start))
+        eta = self.eta()
+        if eta is not None:
+            parts.append("ETA %s" % fmt_duration(eta))
+
+        return "%s: %s" % (self.name, ", ".join(parts))
+
+    def _report(self):
+        with self._lock:
+            now = monotonic()
+            if now < self._next:
+                return
+            self._next = now + self.interval
+
+            if not self.tty:
+                logger.info("%s", self.line())
+                return
+
+            line = self.line()
+            self._console.acquire()
+            try:
+                self._console.stream.status(line)
+            finally:
+                self._console.release()
+
+    def close(self):
+        """
+        Stop reporting and clear the status line.
+        """
+        with self._lock:
+            self._next = float("inf")
+            if self._console is not None:
+                self._console.acquire()
+                try:
+                    self._console.stream.clear()
+                finally:
+                    self._console.release()
@@ -0,0 +1,407 @@
+"""
+results.py
+
+Helpers for reading, writing and working with check results.
+
+Results are written as a schema versioned container: a JSON header line,
+holding the run metadata and an index of the checks, followed by one JSON
+line per check. The index allows loading a single check without decoding
+the others.
+
+The container can be gzip or xz compressed. The header and every check are
+then compressed as separate members of the file, which gzip and xz tools
+read as one stream, and the index holds the offsets of the compressed
+members so a check is decompressed on its own.
+
+Copyright (c) 2016  Nexenta Systems
+William Kettler <william.kettler@nexenta.com>
+"""
+
+import os
+import json
+import gzip
+import lzma
+from collections import OrderedDict
+
+# Current result schema version, unversioned output is schema 1
+SCHEMA = 2
+
+# Supported compressions and their file suffix
+COMPRESSIONS = {
+    None: ("", open),
+    "gzip": (".gz", gzip.open),
+    "xz": (".xz", lzma.open)
+}
+
+# Compression of a single member
+COMPRESSORS = {
+    "gzip": (gzip.compress, gzip.decompress),
+    "xz": (lzma.compress, lzma.decompress)
+}
+
+# Magic numbers of the compressed containers
+MAGIC = [
+    (b"\x1f\x8b", "gzip"),
+    (b"\xfd7zXZ\x00", "xz")
+]
+
+# Result fields identifying the entries of a list of results, in order of
+# preference
+KEYS = ("disk", "pool", "service", "name", "host", "server", "vdev")
+
+
+def entry_key(entry, index):
+    """
+    Return the stable key of an entry in a list of results.
+
+    Args:
+        entry (dict): Result entry
+        index (int): Position of the entry, used if no key field is present
+    Returns:
+        A (field, value) tuple.
+    """
+    if isinstance(entry, dict):
+        for k in KEYS:
+            if k in entry and entry[k] is not None:
+                return k, str(entry[k])
+
+    return "index", str(index)
+
+
+def _number(v):
+    """
+    Return the value as a number or None if it isn't numeric.
+    """
+    if isinstance(v, bool):
+        return int(v)
+    if isinstance(v, (int, float)):
+        return v
+    if isinstance(v, str):
+        try:
+            return float(v)
+        except ValueError:
+            return None
+
+    return None
+
+
+def _fields(d, prefix, fields, strings):
+    """
+    Collect the numeric values of a dict, nested dicts use dotted names.
+    """
+    for k, v in d.items():
+        name = "%s.%s" % (prefix, k) if prefix else k
+        if isinstance(v, dict):
+            _fields(v, name, fields, strings)
+            continue
+        n = _number(v)
+        if n is not None:
+            fields[name] = n
+        elif strings and isinstance(v, str):
+            fields[name] = v
+
+
+def flatten(result, strings=False):
+    """
+    Flatten check results into keyed numeric fields.
+
+    A dict result is a single entry with an empty key, each entry of a list
+    result is keyed by its stable sub-key, i.e. ("disk", "c1t0d0"). Entries
+    sharing a key get a #N suffix. The key field itself is not included in
+    the fields.
+
+    Args:
+        result (dict|list): Check results
+    Kwargs:
+        strings (bool): Also include non-numeric string fields
+    Returns:
+        A generator of (key, fields) tuples.
+    """
+    if isinstance(result, list):
+        entries = []
+        seen = {}
+        for i, e in enumerate(result):
+            key = entry_key(e, i)
+            seen[key] = seen.get(key, 0) + 1
+            if seen[key] > 1:
+                key = (key[0], "%s#%d" % (key[1], seen[key]))
+            entries.append((key, e))
+    elif isinstance(result, dict):
+        entries = [((), result)]
+    else:
+        entries = []
+
+    for key, entry in entries:
+        fields = {}
+        if isinstance(entry, dict):
+            _fields(entry, "", fields, strings)
+        else:
+            n = _number(entry)
+            if n is not None:
+                fields["value"] = n
+        if key:
+            fields.pop(key[0], None)
+        yield key, fields
+
+
+def _result(entry):
+    """
+    Return the check results of an output entry of any schema.
+    """
+    if isinstance(entry, dict) and "f" in entry and "result" in entry:
+        return entry["result"]
+
+    return entry
+
+
+def diff(a, b, threshold=0.0):
+    """
+    Compare two result files.
+
+    The checks are matched by name and the entries of each check by their
+    stable sub-key, so the comparison is linear in the size of the results.
+
+    Args:
+        a (Results): Baseline results
+        b (Results): New results
+    Kwargs:
+        threshold (float): Minimum relative change, i.e. 0.05 for 5%, of a
+                           numeric field to be reported
+    Returns:
+        A list of changes, each a dict with the check name, entry key,
+        field, both values and for numeric fields the delta and relative
+        change. Entries only present on one side have the field None and a
+        "change" of "added" or "removed".
+    """
+    changes = []
+    in_a = set(a.names())
+    in_b = set(b.names())
+    names = a.names() + [n for n in b.names() if n not in in_a]
+
+    for name in names:
+        old = dict(flatten(_result(a.get(name)), strings=True)) \
+            if name in in_a else {}
+        new = dict(flatten(_result(b.get(name)), strings=True)) \
+            if name in in_b else {}
+
+        keys = list(old) + [k for k in new if k not in old]
+        for key in keys:
+            if key not in new or key not in old:
+                changes.append({
+                    "check": name,
+                    "key": key,
+                    "field": None,
+                    "change": "removed" if key not in new else "added"
+                })
+                continue
+
+            fields = sorted(set(old[key]) | set(new[key]))
+            for f in fields:
+                va = old[key].get(f)
+                vb = new[key].get(f)
+                if va == vb:
+                    continue
+                change = {
+                    "check": name,
+                    "key": key,
+                    "field": f,
+                    "a": va,
+                    "b": vb,
+                    "change": "changed"
+                }
+                if isinstance(va, (int, float)) and \
+                        isinstance(vb, (int, float)):
+                    change["delta"] = vb - va
+                    change["relative"] = (vb - va) / abs(va) if va else None
+                    if change["relative"] is not None and \
+                            abs(change["relative"]) < threshold:
+                        continue
+                changes.append(change)
+
+    return changes
+
+
+def dump(path, output, compression=None):
+    """
+    Write the output to a result container.
+
+    Args:
+        path (str): Path to the output file, the compression suffix is not
+                    added
+        output (dict): Output dictionary with a "results" dict, all other
+                       keys are stored in the header
+    Kwargs:
+        compression (str): None, "gzip" or "xz"
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError("Unsupported compression '%s'" % compression)
+
+    compress = COMPRESSORS[compression][0] if compression else bytes
+
+    header = OrderedDict((k, v) for k, v in output.items() if k != "results")
+    header["schema"] = SCHEMA
+    header["checks"] = []
+    header["index"] = {}
+
+    # Serialize the checks first to build the index of byte offsets, of the
+    # compressed members if compressed
+    lines = []
+    offset = 0
+    for name, entry in output["results"].items():
+        line = compress((json.dumps(entry) + "\n").encode("utf-8"))
+        header["checks"].append(name)
+        header["index"][name] = [offset, len(line)]
+        offset += len(line)
+        lines.append(line)
+
+    with open(path, "wb") as fh:
+        fh.write(compress((json.dumps(header) + "\n").encode("utf-8")))
+        for line in lines:
+            fh.write(line)
+
+
+def load(path):
+    """
+    Open a result file of any schema, compressed or not.
+
+    Args:
+        path (str): Path to the result file
+    Returns:
+        A Results object.
+    """
+    return Results(path)
+
+
+class Results(object):
+    """
+    Read access to a result file.
+
+    Schema 2 containers are read lazily, one check at a time. Schema 1 files,
+    a single JSON document, are loaded in full.
+
+    Attributes:
+        path (str): Path to the result file
+        header (dict): Run metadata, i.e. version
+        schema (int): Schema version of the file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._legacy = None
+
+        with open(path, "rb") as fh:
+            magic = fh.read(6)
+        compression = None
+        self._decompress = None
+        for m, c in MAGIC:
+            if magic.startswith(m):
+                compression = c
+                break
+
+        self._fh = COMPRESSIONS[compression][1](path, "rb")
+        first = self._fh.readline()
+        try:
+            header = json.loads(first.decode("utf-8"))
+        except ValueError:
+            header = None
+
+        if isinstance(header, dict) and "schema" in header:
+            self.header = header
+            self.schema = header["schema"]
+            self._start = len(first)
+            if compression:
+                # The compressed checks follow the compressed header
+                self._decompress = COMPRESSORS[compression][1]
+                self._start = os.path.getsize(path) - \
+                    sum(l for _, l in header["index"].values())
+        else:
+            # Legacy indented JSON document
+            self._fh.seek(0)
+            document = json.loads(self._fh.read().decode("utf-8"))
+            self._fh.close()
+            self._fh = None
+            self._legacy = document.pop("results", None) or {}
+            self.header = document
+            self.schema = 1
+
+    @property
+    def version(self):
+        """
+        The AutoSAC version which produced the results.
+        """
+        return self.header.get("version")
+
+    def names(self):
+        """
+        Return the check names in run order.
+
+        Returns:
+            A list of check names.
+        """
+        if self._legacy is not None:
+            return list(self._legacy.keys())
+
+        return list(self.header["checks"])
+
+    def get(self, name):
+        """
+        Load the output entry of a single check.
+
+        Args:
+            name (str): Check name
+        Returns:
+            The output entry.
+        """
+        if self._legacy is not None:
+            return self._legacy[name]
+
+        offset, length = self.header["index"][name]
+        if self._decompress is not None:
+            with open(self.path, "rb") as fh:
+                fh.seek(self._start + offset)
+                line = self._decompress(fh.read(length))
+        else:
+            self._fh.seek(self._start + offset)
+            line = self._fh.read(length)
+
+        return json.loads(line.decode("utf-8"))
+
+    def items(self):
+        """
+        Iterate over all checks in run order.
+
+        Returns:
+            A generator of (name, entry) tuples.
+        """
+        if self._legacy is not None:
+            for name, entry in self._legacy.items():
+                yield name, entry
+            return
+
+        # Sequential reads avoid seeking in compressed containers, the
+        # members are read as a single stream
+        self._fh.seek(0)
+        self._fh.readline()
+        for name in self.header["checks"]:
+            line = self._fh.readline()
+            yield name, json.loads(line.decode("utf-8"))
+
+    def close(self):
+        """
+        Close the result file.
+        """
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    def __contains__(self, name):
+        if self._legacy is not None:
+            return name in self._legacy
+
+        return name in self.header["index"]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,131 @@
+"""
+runner.py
+
+This module contains functions for executing the configured checks.
+
+Copyright (c) 2016  Nexenta Systems
+William Kettler <william.kettler@nexenta.com>
+"""
+
+import time
+import logging
+import lib.checks as checks
+from threading import Thread
+from queue import Queue, Empty
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_check(c):
+    """
+    Return the check function referenced by a configured check.
+
+    Args:
+        c (dict): Configured check
+    Returns:
+        The check function.
+    """
+    try:
+        return getattr(checks, c["f"])
+    except AttributeError:
+        raise RuntimeError("The check function '%s' does not exist" % c["f"])
+
+
+def run_check(c):
+    """
+    Execute a configured check.
+
+    Args:
+        c (dict): Configured check
+    Returns:
+        The output entry for the check including the check results and its
+        duration in seconds.
+    """
+    logger.info("Check %s in progress", c["name"].upper())
+    start = time.time()
+    try:
+        f = get_check(c)
+        result = f(*c["args"], **c["kwargs"])
+    # Catch all clause because the script shouldn't barf on the user
+    except Exception as e:
+        logger.error(str(e))
+        logger.debug(str(e), exc_info=True)
+        result = {
+            "success": False,
+            "error": str(e)
+        }
+
+    return {
+        "f": c["f"],
+        "args": c["args"],
+        "kwargs": c["kwargs"],
+        "result": result,
+        "duration": round(time.time() - start, 3)
+    }
+
+
+def run_checks(checks, jobs=1):
+    """
+    Execute configured checks, jobs at a time. The checks are started in the
+    order given.
+
+    Args:
+        checks (list): Configured checks
+    Kwargs:
+        jobs (int): Number of checks run at the same time
+    Returns:
+        A dict of output entries keyed by check name.
+    """
+    checkq = Queue()
+    outputs = {}
+
+    def worker():
+        while True:
+            try:
+                c = checkq.get_nowait()
+            except Empty:
+                break
+            outputs[c["name"]] = run_check(c)
+
+    for c in checks:
+        checkq.put(c)
+
+    # A single job runs in the calling thread
+    if jobs <= 1:
+        worker()
+        return outputs
+
+    thrs = []
+    for _ in range(min(jobs, len(checks))):
+        t = Thread(target=worker)
+        t.start()
+        thrs.append(t)
+
+    for t in thrs:
+        t.join()
+
+    return outputs
+
+
+def succeeded(result):
+    """
+    Determine whether check results passed.
+
+    Args:
+        result (dict|list): Check results
+    Returns:
+        True if passed, False if failed and None if skipped.
+    """
+    if isinstance(result, list):
+        states = [succeeded(r) for r in result]
+        if False in states:
+            return False
+        if True in states:
+            return True
+        return None
+
+    if not isinstance(result, dict) or result.get("skipped"):
+        return None
+
+    return bool(result.get("success"))
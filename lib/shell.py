@@ -0,0 +1,212 @@
+"""
+shell.py
+
+Persistent shell co-process.
+
+Commands are written to a long-lived /bin/sh instead of starting a new shell
+for every command. Each command runs in a subshell, so it can't change the
+state of the co-process, and is followed by a unique sentinel line carrying
+its exit status which frames the output. A command exceeding its timeout is
+killed together with the shell, which is restarted by the next command, as
+it is if it dies.
+
+Each thread, and each process, gets its own shell so commands still run in
+parallel. A thread's shell is closed when the thread exits.
+
+Copyright (c) 2016  Nexenta Systems
+William Kettler <william.kettler@nexenta.com>
+"""
+
+import os
+import re
+import time
+import uuid
+import atexit
+import select
+import signal
+import weakref
+import logging
+import threading
+import subprocess
+
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+_shells = []
+_shells_lock = threading.Lock()
+
+
+class Timeout(Exception):
+    """
+    This exception is raised when a command exceeds its timeout.
+    """
+    pass
+
+
+class Shell(object):
+    """
+    A long-lived shell executing commands one at a time.
+
+    Attributes:
+        path (str): Shell executable
+        pid (int): The process owning the shell
+    """
+
+    def __init__(self, path="/bin/sh"):
+        self.path = path
+        self.pid = os.getpid()
+        self._proc = None
+
+    def _start(self):
+        """
+        Start a new shell in its own process group.
+        """
+        self.close()
+        self._proc = subprocess.Popen([self.path], stdin=subprocess.PIPE,
+                                      stdout=subprocess.PIPE,
+                                      stderr=subprocess.STDOUT,
+                                      start_new_session=True)
+        logger.debug("Started shell %d", self._proc.pid)
+
+    def close(self):
+        """
+        Kill the shell and any command it is running.
+        """
+        if self._proc is None:
+            return
+
+        try:
+            os.killpg(self._proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        self._proc.wait()
+        self._proc.stdin.close()
+        self._proc.stdout.close()
+        self._proc = None
+
+    def _write(self, script):
+        """
+        Send a script to the shell, restarting it if it has exited.
+        """
+        if self._proc is None or self._proc.poll() is not None:
+            self._start()
+
+        try:
+            self._proc.stdin.write(script)
+            self._proc.stdin.flush()
+        except (IOError, OSError):
+            # The shell exited before reading the script
+            self._start()
+            self._proc.stdin.write(script)
+            self._proc.stdin.flush()
+
+    def run(self, cmd, timeout=None):
+        """
+        Execute a command.
+
+        Args:
+            cmd (str): Command to execute
+        Kwargs:
+            timeout (int): Command timeout in seconds
+        Returns:
+            A (retcode, output) tuple, the output is STDOUT and STDERR merged
+            as bytes.
+        """
+        sentinel = "__AUTOSAC_%s__" % uuid.uuid4().hex
+        # eval keeps a syntax error in the command from consuming the
+        # sentinel, the leading newline puts the sentinel on its own line
+        script = "( eval '%s' ) </dev/null 2>&1\n" \
+            "printf '\\n%s %%d\\n' $?\n" % \
+            (cmd.replace("'", "'\\''"), sentinel)
+        marker = re.compile(b"\n" + sentinel.encode() + b" (\\d+)\n")
+
+        self._write(script.encode())
+
+        fd = self._proc.stdout.fileno()
+        deadline = time.time() + timeout if timeout else None
+        output = b""
+        start = 0
+        while True:
+            # Only search the data read since the last search
+            m = marker.search(output, start)
+            if m is not None:
+                return int(m.group(1)), output[:m.start()]
+
+            wait = None
+            if deadline is not None:
+                wait = deadline - time.time()
+                if wait <= 0:
+                    self.close()
+                    raise Timeout(cmd)
+
+            ready, _, _ = select.select([fd], [], [], wait)
+            if not ready:
+                continue
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                retcode = self._proc.wait()
+                self.close()
+                raise RuntimeError("The shell exited with status %d while "
+                                   "running '%s'" % (retcode, cmd))
+            # A partially read sentinel line is searched again
+            start = max(0, len(output) - len(sentinel) - 16)
+            output += chunk
+
+
+class _Owner(object):
+    """
+    Thread-local reference to a thread's shell. The thread-local data of a
+    thread is released when it exits, which closes the shell.
+    """
+
+    def __init__(self, shell):
+        self.shell = shell
+        weakref.finalize(self, _release, shell)
+
+
+def _release(shell):
+    """
+    Close a shell whose thread exited.
+    """
+    # A forked child must not kill its parent's shell
+    if shell.pid != os.getpid():
+        return
+
+    shell.close()
+    with _shells_lock:
+        if shell in _shells:
+            _shells.remove(shell)
+
+
+def get():
+    """
+    Return the shell of the calling thread.
+
+    Returns:
+        A Shell object.
+    """
+    owner = getattr(_local, "owner", None)
+
+    # A forked child must not share its parent's shell
+    if owner is None or owner.shell.pid != os.getpid():
+        shell = Shell()
+        with _shells_lock:
+            _shells.append(shell)
+        _local.owner = _Owner(shell)
+
+    return _local.owner.shell
+
+
+def close():
+    """
+    Stop the shells started by this process.
+    """
+    with _shells_lock:
+        for s in _shells:
+            if s.pid == os.getpid():
+                s.close()
+        del _shells[:]
+
+
+atexit.register(close)
@@ -0,0 +1,188 @@
+"""
+sntp.py
+
+Simple Network Time Protocol (RFC 4330) client.
+
+Each server is sampled several times and the sample with the lowest round
+trip delay, which has the smallest error bound, provides the clock offset.
+All servers are sampled at the same time.
+
+Copyright (c) 2016  Nexenta Systems
+William Kettler <william.kettler@nexenta.com>
+"""
+
+import time
+import socket
+import struct
+import logging
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds between the NTP era (1900) and the Unix epoch (1970)
+EPOCH = 2208988800
+
+# Mode, stratum, poll, precision, root delay, root dispersion, reference ID
+# and the reference, originate, receive and transmit timestamps
+PACKET = struct.Struct("!BBbbIII4Q")
+
+# LI 0, version 4, mode 3 (client)
+CLIENT = (0 << 6) | (4 << 3) | 3
+
+# Server mode and the leap indicator of an unsynchronized server
+SERVER = 4
+ALARM = 3
+
+
+def to_ntp(t):
+    """
+    Convert a Unix timestamp to a 64-bit NTP timestamp.
+    """
+    return int((t + EPOCH) * 2 ** 32)
+
+
+def from_ntp(v):
+    """
+    Convert a 64-bit NTP timestamp to a Unix timestamp.
+    """
+    return v / 2.0 ** 32 - EPOCH
+
+
+def query(sock, address, timeout=2):
+    """
+    Send a single request and compute the clock offset and delay.
+
+    offset = ((t2 - t1) + (t3 - t4)) / 2
+    delay = (t4 - t1) - (t3 - t2)
+
+    Args:
+        sock (socket): UDP socket
+        address (tuple): Server address
+    Kwargs:
+        timeout (float): Response timeout in seconds
+    Returns:
+        A dict with the "offset" and "delay" in seconds and the "stratum".
+    """
+    t1 = time.time()
+    tx = to_ntp(t1)
+    sock.sendto(PACKET.pack(CLIENT, 0, 0, 0, 0, 0, 0, 0, 0, 0, tx), address)
+
+    deadline = t1 + timeout
+    while True:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise socket.timeout("timed out")
+        sock.settimeout(remaining)
+        data, _ = sock.recvfrom(512)
+        t4 = time.time()
+        if len(data) < PACKET.size:
+            continue
+        fields = PACKET.unpack_from(data)
+        # Ignore late responses to previous requests
+        if fields[8] == tx:
+            break
+
+    li = fields[0] >> 6
+    mode = fields[0] & 0x7
+    stratum = fields[1]
+    if mode != SERVER:
+        raise RuntimeError("Unexpected NTP mode %d" % mode)
+    if li == ALARM or not 1 <= stratum <= 15:
+        raise RuntimeError("The server is not synchronized")
+
+    t2 = from_ntp(fields[9])
+    t3 = from_ntp(fields[10])
+
+    return {
+        "offset": ((t2 - t1) + (t3 - t4)) / 2,
+        "delay": (t4 - t1) - (t3 - t2),
+        "stratum": stratum
+    }
+
+
+def sample(server, samples=4, port=123, timeout=2, interval=0.1):
+    """
+    Sample a server and select the minimum delay sample.
+
+    The jitter is the RMS of the other samples' offsets relative to the
+    selected one.
+
+    Args:
+        server (str): Server address
+    Kwargs:
+        samples (int): Number of requests
+        port (int): Server port
+        timeout (float): Response timeout per request in seconds
+        interval (float): Seconds between requests
+    Returns:
+        A dict with the server, offset, delay, jitter, stratum and the number
+        of samples received and lost.
+    """
+    family, _, _, _, address = socket.getaddrinfo(server, port, 0,
+                                                  socket.SOCK_DGRAM)[0]
+    sock = socket.socket(family, socket.SOCK_DGRAM)
+    received = []
+    errors = []
+
+    try:
+        for i in range(samples):
+            if i:
+                time.sleep(interval)
+            try:
+                received.append(query(sock, address, timeout=timeout))
+            except (socket.timeout, RuntimeError) as e:
+                logger.debug("%s: %s", server, str(e))
+                errors.append(str(e))
+    finally:
+        sock.close()
+
+    if not received:
+        raise RuntimeError("No valid response from %s: %s" %
+                           (server, errors[-1]))
+
+    best = min(received, key=lambda s: s["delay"])
+    others = [s["offset"] - best["offset"] for s in received if s is not best]
+    jitter = (sum(d * d for d in others) / len(others)) ** 0.5 \
+        if others else 0.0
+
+    return {
+        "server": server,
+        "offset": best["offset"],
+        "delay": best["delay"],
+        "jitter": jitter,
+        "stratum": best["stratum"],
+        "samples": len(received),
+        "lost": len(errors)
+    }
+
+
+def sample_all(servers, **kwargs):
+    """
+    Sample several servers at the same time.
+
+    Args:
+        servers (list): Server addresses
+    Kwargs:
+        Passed to sample()
+    Returns:
+        A dict keyed by server of sample() results or the exception raised.
+    """
+    results = {}
+
+    def worker(server):
+        try:
+            results[server] = sample(server, **kwargs)
+        except (OSError, RuntimeError) as e:
+            logger.debug(str(e), exc_info=True)
+            results[server] = e
+
+    thrs = []
+    for s in servers:
+        t = threading.Thread(target=worker, args=(s,))
+        t.start()
+        thrs.append(t)
+    for t in thrs:
+        t.join()
+
+    return results
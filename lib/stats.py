@@ -0,0 +1,121 @@
+"""
+stats.py
+
+Statistics helpers shared by the checks.
+
+Copyright (c) 2016  Nexenta Systems
+William Kettler <william.kettler@nexenta.com>
+"""
+
+
+def percentile(values, p):
+    """
+    Return the p-th percentile of the values using linear interpolation
+    between the closest ranks.
+
+    Args:
+        values (list): Sorted numeric values
+        p (float): Percentile between 0 and 100
+    Returns:
+        The percentile or None if there are no values.
+    """
+    if not len(values):
+        return None
+
+    rank = (len(values) - 1) * p / 100.0
+    lo = int(rank)
+    hi = min(lo + 1, len(values) - 1)
+
+    return values[lo] + (values[hi] - values[lo]) * (rank - lo)
+
+
+def summarize(values):
+    """
+    Return the p50, p95 and maximum of the values.
+
+    Args:
+        values (list): Numeric values, need not be sorted
+    Returns:
+        The summary as a dict.
+    """
+    ordered = sorted(values)
+
+    return {
+        "p50": percentile(ordered, 50),
+        "p95": percentile(ordered, 95),
+        "max": ordered[-1] if ordered else None
+    }
+
+
+def median(values):
+    """
+    Return the median of the values.
+
+    Args:
+        values (list): Numeric values, need not be sorted
+    Returns:
+        The median or None if there are no values.
+    """
+    return percentile(sorted(values), 50)
+
+
+# Two-sided Student t critical values for 1 to 30 degrees of freedom followed
+# by the normal approximation used for larger samples
+T_TABLE = {
+    0.90: [6.314, 2.920, 2.353, 2.132, 2.015, 1.943, 1.895, 1.860, 1.833,
+           1.812, 1.796, 1.782, 1.771, 1.761, 1.753, 1.746, 1.740, 1.734,
+           1.729, 1.725, 1.721, 1.717, 1.714, 1.711, 1.708, 1.706, 1.703,
+           1.701, 1.699, 1.697, 1.645],
+    0.95: [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262,
+           2.228, 2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101,
+           2.093, 2.086, 2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052,
+           2.048, 2.045, 2.042, 1.960],
+    0.99: [63.657, 9.925, 5.841, 4.604, 4.032, 3.707, 3.499, 3.355, 3.250,
+           3.169, 3.106, 3.055, 3.012, 2.977, 2.947, 2.921, 2.898, 2.878,
+           2.861, 2.845, 2.831, 2.819, 2.807, 2.797, 2.787, 2.779, 2.771,
+           2.763, 2.756, 2.750, 2.576]
+}
+
+
+def mean_ci(values, confidence=0.95):
+    """
+    Return the mean of the values and the half-width of its confidence
+    interval.
+
+    Args:
+        values (list): At least two numeric values
+    Kwargs:
+        confidence (float): Confidence level, 0.90, 0.95 or 0.99
+    Returns:
+        A (mean, half-width) tuple.
+    """
+    if confidence not in T_TABLE:
+        raise ValueError("Unsupported confidence level %s" % confidence)
+    n = len(values)
+    if n < 2:
+        raise ValueError("At least two values are required")
+
+    mean = sum(values) / float(n)
+    var = sum((v - mean) ** 2 for v in values) / (n - 1)
+    t = T_TABLE[confidence][min(n - 1, 31) - 1]
+
+    return mean, t * (var / n) ** 0.5
+
+
+def precision(values, confidence=0.95):
+    """
+    Return the confidence interval half-width relative to the mean, i.e.
+    0.05 means the mean is known within +/- 5%.
+
+    Args:
+        values (list): At least two numeric values
+    Kwargs:
+        confidence (float): Confidence level, 0.90, 0.95 or 0.99
+    Returns:
+        The relative precision or None if the mean is zero.
+    """
+    mean, half = mean_ci(values, confidence)
+    if not mean:
+        return None
+
+    return half / abs(mean)
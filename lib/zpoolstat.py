@@ -0,0 +1,325 @@
+"""
+zpoolstat.py
+
+Incremental parsers for zpool command output.
+
+Copyright (c) 2016  Nexenta Systems
+William Kettler <william.kettler@nexenta.com>
+"""
+
+import re
+import sys
+import logging
+import subprocess
+from array import array
+from collections import OrderedDict
+from lib.execute import RetcodeError
+
+
+logger = logging.getLogger(__name__)
+
+# Size suffixes used by the zpool command
+SIZES = {
+    "": 1,
+    "B": 1,
+    "K": 1024,
+    "M": 1024 ** 2,
+    "G": 1024 ** 3,
+    "T": 1024 ** 4,
+    "P": 1024 ** 5
+}
+
+# Latency suffixes converted to milliseconds
+TIMES = {
+    "ns": 1e-6,
+    "us": 1e-3,
+    "ms": 1.0,
+    "s": 1000.0
+}
+
+# Pool sections listed at the same level as the pool itself
+SECTIONS = ("logs", "cache", "spares", "special", "dedup")
+
+# Scan progress of an in progress scrub or resilver, older releases report
+# "X scanned out of Y at R/s", newer "X scanned at R/s, Y issued at R/s,
+# Z total"
+SIZE = r"([\d.]+[BKMGTP]?)"
+SCANNED_OF = re.compile(SIZE + r" scanned out of " + SIZE)
+ISSUED = re.compile(SIZE + r" scanned at [^,]+, " + SIZE +
+                    r" issued at [^,]+, " + SIZE + r" total")
+DONE = re.compile(r"([\d.]+)% done")
+
+# Per-vdev statistics kept by the iostat sampler
+FIELDS = ("read_ops", "write_ops", "read_bw", "write_bw", "read_lat",
+          "write_lat")
+
+
+def parse_size(s):
+    """
+    Convert a zpool size, i.e. 1.5K, to a number.
+
+    Args:
+        s (str): Size
+    Returns:
+        The size as a float or None if undefined.
+    """
+    if s == "-":
+        return None
+
+    suffix = s[-1] if s[-1].isalpha() else ""
+
+    return float(s[:len(s) - len(suffix)]) * SIZES[suffix.upper()]
+
+
+def parse_time(s):
+    """
+    Convert a zpool latency, i.e. 12ms, to milliseconds.
+
+    Args:
+        s (str): Latency
+    Returns:
+        The latency in ms as a float or None if undefined.
+    """
+    if s == "-":
+        return None
+
+    for suffix in ("ns", "us", "ms", "s"):
+        if s.endswith(suffix):
+            return float(s[:-len(suffix)]) * TIMES[suffix]
+
+    # Parsable output is in nanoseconds
+    return float(s) * TIMES["ns"]
+
+
+def run(cmd):
+    """
+    Execute a command and yield its output line by line as it is produced.
+
+    Args:
+        cmd (list): Command and arguments
+    Returns:
+        A generator of output lines.
+    """
+    logger.debug(" ".join(cmd))
+
+    ph = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                          stderr=subprocess.STDOUT)
+    tail = []
+    try:
+        for bline in ph.stdout:
+            line = bline.decode(sys.stdout.encoding)
+            # Keep the last few lines for the error message
+            tail = (tail + [line])[-10:]
+            yield line
+    finally:
+        if ph.poll() is None:
+            ph.kill()
+        ph.stdout.close()
+        retcode = ph.wait()
+
+    if retcode:
+        raise RetcodeError(" ".join(cmd), retcode, output="".join(tail))
+
+
+def iostat(pools, interval, count, latency=True):
+    """
+    Yield the 'zpool iostat -v' output lines for the pools.
+
+    Args:
+        pools (list): Pool names
+        interval (int): Sample interval in seconds
+        count (int): Number of reports
+    Kwargs:
+        latency (bool): Include the latency columns (-l)
+    Returns:
+        A generator of output lines.
+    """
+    cmd = ["zpool", "iostat", "-v"]
+    if latency:
+        cmd.append("-l")
+    cmd.extend(pools)
+    cmd.extend([str(interval), str(count)])
+
+    return run(cmd)
+
+
+def parse_iostat(lines):
+    """
+    Incrementally parse 'zpool iostat -v' output.
+
+    Vdevs are named by their path in the pool configuration, i.e.
+    tank/mirror-0/c1t0d0, and log, cache and spare devices are listed under
+    the pool, i.e. tank/logs/c2t0d0.
+
+    Args:
+        lines (iterable): Output lines
+    Returns:
+        A generator of (report, vdev, stats) tuples where report is the zero
+        based report number and stats a dict of the FIELDS.
+    """
+    report = -1
+    stack = []
+
+    for line in lines:
+        stripped = line.strip()
+        if not stripped or stripped.startswith("-"):
+            continue
+
+        fields = stripped.split()
+
+        # The column header marks the start of a new report
+        if fields[0] == "pool" and "alloc" in fields:
+            report += 1
+            stack = []
+            continue
+        if "capacity" in fields or report < 0:
+            continue
+
+        indent = len(line) - len(line.lstrip())
+        name = fields[0]
+        if indent == 0 and name in SECTIONS and stack:
+            # Sections belong to the pool listed before them
+            indent = 1
+        while stack and stack[-1][0] >= indent:
+            stack.pop()
+        stack.append((indent, name))
+        vdev = "/".join(n for _, n in stack)
+
+        values = fields[3:]
+        stats = {
+            "read_ops": parse_size(values[0]) if len(values) > 0 else None,
+            "write_ops": parse_size(values[1]) if len(values) > 1 else None,
+            "read_bw": parse_size(values[2]) if len(values) > 2 else None,
+            "write_bw": parse_size(values[3]) if len(values) > 3 else None,
+            "read_lat": parse_time(values[4]) if len(values) > 4 else None,
+            "write_lat": parse_time(values[5]) if len(values) > 5 else None
+        }
+
+        yield report, vdev, stats
+
+
+def sample(lines, skip=1):
+    """
+    Collect per-vdev samples from 'zpool iostat -v' output.
+
+    Args:
+        lines (iterable): Output lines
+    Kwargs:
+        skip (int): Number of leading reports to ignore, the first report
+                    contains the averages since boot
+    Returns:
+        An ordered dict of vdev to a dict of FIELDS to compact arrays of
+        samples, in the order the vdevs were listed.
+    """
+    samples = OrderedDict()
+
+    for report, vdev, stats in parse_iostat(lines):
+        if report < skip:
+            continue
+        if vdev not in samples:
+            samples[vdev] = dict((f, array("d")) for f in FIELDS)
+        for f in FIELDS:
+            if stats[f] is not None:
+                samples[vdev][f].append(stats[f])
+
+    return samples
+
+
+def status(pools=None):
+    """
+    Yield the 'zpool status' output lines for the pools.
+
+    Kwargs:
+        pools (list): Pool names, defaults to all pools
+    Returns:
+        A generator of output lines.
+    """
+    return run(["zpool", "status"] + list(pools or []))
+
+
+def _scan(pool, header, progress):
+    """
+    Build the scan status of a pool from its scan lines.
+    """
+    scan = {
+        "pool": pool,
+        "function": None,
+        "state": "none",
+        "examined": None,
+        "total": None,
+        "percent": None
+    }
+    words = header.split()
+
+    if not words or words[0] == "none":
+        return scan
+    scan["function"] = "resilver" if words[0].startswith("resilver") \
+        else "scrub"
+
+    if "in progress" in header:
+        scan["state"] = "in progress"
+    elif "paused" in header:
+        scan["state"] = "paused"
+    elif "canceled" in header:
+        scan["state"] = "canceled"
+    else:
+        scan["state"] = "completed"
+
+    text = " ".join(progress)
+    m = ISSUED.search(text)
+    if m is not None:
+        # Issued I/O is what has actually been verified
+        scan["examined"] = parse_size(m.group(2))
+        scan["total"] = parse_size(m.group(3))
+    else:
+        m = SCANNED_OF.search(text)
+        if m is not None:
+            scan["examined"] = parse_size(m.group(1))
+            scan["total"] = parse_size(m.group(2))
+    m = DONE.search(text)
+    if m is not None:
+        scan["percent"] = float(m.group(1))
+
+    return scan
+
+
+def parse_scan(lines):
+    """
+    Incrementally parse the scrub and resilver status of each pool from
+    'zpool status' output.
+
+    Args:
+        lines (iterable): Output lines
+    Returns:
+        A generator of dicts with the "pool", the scan "function", scrub or
+        resilver, its "state", none, in progress, paused, canceled or
+        completed, the bytes "examined" out of the "total" and the "percent"
+        done.
+    """
+    pool = None
+    header = None
+    progress = []
+    in_scan = False
+
+    for line in lines:
+        stripped = line.strip()
+        key, sep, rest = stripped.partition(":")
+
+        # Continuation lines are indented and have no "key:" prefix
+        if in_scan and stripped and not (sep and " " not in key):
+            progress.append(stripped)
+            continue
+        in_scan = False
+
+        if sep and key == "pool":
+            if pool is not None:
+                yield _scan(pool, header or "", progress)
+            pool = rest.strip()
+            header = None
+            progress = []
+        elif sep and key == "scan" and pool is not None:
+            header = rest.strip()
+            in_scan = True
+
+    if pool is not None:
+        yield _scan(pool, header or "", progress)
@@ -0,0 +1,161 @@
+"""
+test_devstats.py
+
+Per-disk counter parsers of lib.devstats.
+
+Copyright (c) 2016  Nexenta Systems
+William Kettler <william.kettler@nexenta.com>
+"""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+import lib.devstats as devstats
+
+
+PATH_TO_INST = """#
+#\tCaution! This file contains critical kernel state
+#
+"/pci@0,0/pci15ad,1976@10" 0 "mpt"
+"/scsi_vhci/disk@g5000c500a1b2c3d4" 12 "sd"
+"/scsi_vhci/disk@g5000c500a1b2c3d5" 13 "sd"
+"""
+
+KSTAT = """sd:12:sd12:class\tdisk
+sd:12:sd12:crtime\t52.318711
+sd:12:sd12:reads\t1000
+sd:12:sd12:writes\t500
+sd:12:sd12:nread\t1048576000
+sd:12:sd12:nwritten\t524288000
+sd:12:sd12:rlentime\t3000000000
+sd:12:sd12:wlentime\t1500000000
+sderr:12:sd12,err:class\tdevice_error
+sderr:12:sd12,err:Hard Errors\t0
+sderr:12:sd12,err:Soft Errors\t2
+sderr:12:sd12,err:Transport Errors\t1
+sderr:12:sd12,err:Product\tST4000NM0023    \n"""
+
+
+class TestInstances(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        self.fh = os.fdopen(fd, "w")
+
+    def tearDown(self):
+        self.fh.close()
+        os.remove(self.path)
+
+    def instances(self, text):
+        self.fh.write(text)
+        self.fh.flush()
+        return devstats.instances(self.path)
+
+    def test_instances(self):
+        self.assertEqual(self.instances(PATH_TO_INST), {
+            "/pci@0,0/pci15ad,1976@10": "mpt0",
+            "/scsi_vhci/disk@g5000c500a1b2c3d4": "sd12",
+            "/scsi_vhci/disk@g5000c500a1b2c3d5": "sd13"
+        })
+
+    def test_empty(self):
+        self.assertEqual(self.instances(""), {})
+
+    def test_malformed(self):
+        text = ('/scsi_vhci/disk@g1 12 "sd"\n'
+                '"/scsi_vhci/disk@g2" twelve "sd"\n'
+                '"/scsi_vhci/disk@g3" 3\n'
+                '"/scsi_vhci/disk@g4" 4 "sd"\n')
+        self.assertEqual(self.instances(text),
+                         {"/scsi_vhci/disk@g4": "sd4"})
+
+
+class TestKstatNames(unittest.TestCase):
+
+    def test_names(self):
+        insts = {"/scsi_vhci/disk@g5000c500a1b2c3d4": "sd12"}
+        links = {
+            "/dev/rdsk/c0t5000C500A1B2C3D4d0s0":
+            "/devices/scsi_vhci/disk@g5000c500a1b2c3d4:a,raw",
+            "/dev/rdsk/c0t5000C500A1B2C3D9d0s0":
+            "/devices/scsi_vhci/disk@g5000c500a1b2c3d9:a,raw",
+        }
+        with mock.patch("os.path.realpath", lambda p: links.get(p, p)):
+            names = devstats.kstat_names(["c0t5000C500A1B2C3D4d0",
+                                          "c0t5000C500A1B2C3D9d0",
+                                          "c9t0d0"], insts)
+
+        self.assertEqual(names, {"c0t5000C500A1B2C3D4d0": "sd12"})
+
+
+class TestParse(unittest.TestCase):
+
+    def test_parse(self):
+        stats = devstats.parse(KSTAT.splitlines(True))
+        self.assertEqual(sorted(stats), ["sd12", "sd12,err"])
+        self.assertEqual(stats["sd12"]["reads"], 1000)
+        self.assertEqual(stats["sd12"]["crtime"], 52.318711)
+        self.assertEqual(stats["sd12,err"]["Transport Errors"], 1)
+        self.assertEqual(stats["sd12,err"]["Product"], "ST4000NM0023")
+
+    def test_empty(self):
+        self.assertEqual(devstats.parse([]), {})
+        self.assertEqual(devstats.parse(["\n"]), {})
+
+    def test_malformed(self):
+        lines = ["sd:12:sd12:reads\n",
+                 "sd:12:reads\t10\n",
+                 "kstat: no matching kstats\n",
+                 "sd:12:sd12:writes 5\n",
+                 "sd:13:sd13:reads\t7\n"]
+        self.assertEqual(devstats.parse(lines), {"sd13": {"reads": 7}})
+
+
+class TestCounters(unittest.TestCase):
+
+    def setUp(self):
+        stats = devstats.parse(KSTAT.splitlines(True))
+        self.before = devstats.counters(stats["sd12"], stats["sd12,err"])
+
+    def test_counters(self):
+        c = self.before
+        self.assertEqual(c["nwritten"], 524288000)
+        self.assertEqual(c["rtime"], 0)
+        self.assertEqual(c["soft"], 2)
+        self.assertEqual(c["media"], 0)
+        self.assertEqual(len(c), len(devstats.IO) + len(devstats.ERRORS))
+
+    def test_no_error_kstat(self):
+        stats = devstats.parse(KSTAT.splitlines(True))
+        c = devstats.counters(stats["sd12"], {})
+        self.assertEqual(c["hard"], 0)
+        self.assertEqual(c["reads"], 1000)
+
+    def test_delta(self):
+        after = dict(self.before, reads=2500, writes=1000,
+                     nread=self.before["nread"] + 1024 ** 3,
+                     rlentime=self.before["rlentime"] + 4000000000,
+                     transport=3)
+        d = devstats.delta(self.before, after)
+        self.assertEqual(d["ops"], 2000)
+        self.assertEqual(d["read"], 1024.0)
+        self.assertEqual(d["written"], 0)
+        self.assertEqual(d["asvc_t"], 2.0)
+        self.assertEqual(d["wsvc_t"], 0)
+        self.assertEqual(d["errors"]["transport"], 2)
+        self.assertEqual(d["errors"]["hard"], 0)
+
+    def test_delta_idle(self):
+        d = devstats.delta(self.before, self.before)
+        self.assertEqual(d["ops"], 0)
+        self.assertIsNone(d["asvc_t"])
+        self.assertIsNone(d["wsvc_t"])
+
+    def test_baseline(self):
+        self.assertEqual(devstats.baseline(self.before), 2.0)
+        self.assertIsNone(devstats.baseline({}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+"""
+test_kstat.py
+
+Kernel statistics parsers of lib.kstat.
+
+Copyright (c) 2016  Nexenta Systems
+William Kettler <william.kettler@nexenta.com>
+"""
+
+import unittest
+import lib.kstat as kstat
+
+
+KSTAT = """zfs:0:arcstats:class\tmisc
+zfs:0:arcstats:crtime\t12.512345
+zfs:0:arcstats:hits\t1000
+zfs:0:arcstats:misses\t100
+zfs:0:arcstats:l2_hits\t10
+zfs:0:arcstats:l2_size\t1000000
+zfs:0:arcstats:c\t500
+"""
+
+PROC = """13 1 0x01 86 4128 1795301234 2859318761321
+name                            type data
+hits                            4    123
+misses                          4    45
+c_min                           4    33554432
+arc_no_grow                     4    0
+"""
+
+
+class TestNumber(unittest.TestCase):
+
+    def test_number(self):
+        self.assertEqual(kstat.number("42"), 42)
+        self.assertIsInstance(kstat.number("42"), int)
+        self.assertEqual(kstat.number("0.5"), 0.5)
+        self.assertEqual(kstat.number("misc"), "misc")
+
+
+class TestParseKstat(unittest.TestCase):
+
+    def test_parse(self):
+        stats = kstat.parse_kstat(KSTAT.splitlines(True))
+        self.assertEqual(stats["hits"], 1000)
+        self.assertEqual(stats["l2_size"], 1000000)
+        self.assertEqual(stats["crtime"], 12.512345)
+        self.assertEqual(stats["class"], "misc")
+        self.assertEqual(len(stats), 7)
+
+    def test_empty(self):
+        self.assertEqual(kstat.parse_kstat([]), {})
+        self.assertEqual(kstat.parse_kstat(["\n"]), {})
+
+    def test_malformed(self):
+        lines = ["zfs:0:arcstats:hits\n",
+                 "zfs:0:arcstats:misses 100\n",
+                 "zfs:0:arcstats:c\t\n",
+                 "kstat: invalid statistic\n",
+                 "zfs:0:arcstats:size\t480\n"]
+        self.assertEqual(kstat.parse_kstat(lines), {"size": 480})
+
+    def test_last_kstat_wins(self):
+        lines = ["zfs:0:arcstats:hits\t1\n", "zfs:1:arcstats:hits\t2\n"]
+        self.assertEqual(kstat.parse_kstat(lines), {"hits": 2})
+
+
+class TestParseProc(unittest.TestCase):
+
+    def test_parse(self):
+        stats = kstat.parse_proc(PROC.splitlines(True))
+        self.assertEqual(stats, {
+            "hits": 123,
+            "misses": 45,
+            "c_min": 33554432,
+            "arc_no_grow": 0
+        })
+
+    def test_empty(self):
+        self.assertEqual(kstat.parse_proc([]), {})
+
+    def test_header_only(self):
+        self.assertEqual(kstat.parse_proc(PROC.splitlines(True)[:2]), {})
+
+    def test_malformed(self):
+        lines = ["hits 4\n",
+                 "misses x 45\n",
+                 "size 4 480 extra\n",
+                 "c 4 500\n"]
+        self.assertEqual(kstat.parse_proc(lines), {"c": 500})
+
+
+if __name__ == "__main__":
+    unittest.main()
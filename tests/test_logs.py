@@ -0,0 +1,91 @@
+"""
+test_logs.py
+
+Queued logging of lib.logs.
+
+Copyright (c) 2016  Nexenta Systems
+William Kettler <william.kettler@nexenta.com>
+"""
+
+import os
+import logging
+import tempfile
+import unittest
+import lib.logs as logs
+
+
+CONFIG = """
+[loggers]
+keys=root
+
+[handlers]
+keys=file
+
+[formatters]
+keys=file
+
+[logger_root]
+level=DEBUG
+handlers=file
+
+[handler_file]
+class=FileHandler
+level=DEBUG
+formatter=file
+args=(%r,)
+
+[formatter_file]
+format=%%(message)s
+"""
+
+
+class Unprintable(object):
+
+    def __str__(self):
+        raise ValueError("unprintable")
+
+
+class TestLogs(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.log = os.path.join(self.dir, "test.log")
+        self.config = os.path.join(self.dir, "logging.conf")
+        with open(self.config, "w") as fh:
+            fh.write(CONFIG % self.log)
+        logs.setup(self.config)
+        self.raise_exceptions = logging.raiseExceptions
+        logging.raiseExceptions = False
+
+    def tearDown(self):
+        logs.shutdown()
+        logging.raiseExceptions = self.raise_exceptions
+        for h in logging.getLogger().handlers:
+            for t in getattr(h, "targets", [h]):
+                t.close()
+        logging.getLogger().handlers = []
+        os.remove(self.log)
+        os.remove(self.config)
+        os.rmdir(self.dir)
+
+    def read(self):
+        logs.shutdown()
+        with open(self.log) as fh:
+            return fh.read()
+
+    def test_payload_rendered_by_listener(self):
+        logging.getLogger().debug("%s", logs.Payload({"a": 1}))
+
+        self.assertEqual(self.read(), '{"a": 1}\n')
+
+    def test_bad_records_do_not_stop_the_listener(self):
+        logger = logging.getLogger()
+        logger.info("%d", "x")
+        logger.info("%s", Unprintable())
+        logger.info("after")
+
+        self.assertEqual(self.read(), "after\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
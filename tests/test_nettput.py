@@ -0,0 +1,128 @@
+"""
+test_nettput.py
+
+Network throughput test of lib.nettput.
+
+Copyright (c) 2016  Nexenta Systems
+William Kettler <william.kettler@nexenta.com>
+"""
+
+import socket
+import struct
+import threading
+import unittest
+import lib.nettput as nettput
+
+
+class FakeSocket(object):
+    """
+    Socket returning a captured TCP_INFO buffer.
+    """
+
+    def __init__(self, info=None, error=None):
+        self.info = info
+        self.error = error
+
+    def getsockopt(self, level, opt, size):
+        if self.error is not None:
+            raise self.error
+        return self.info[:size]
+
+
+def tcp_info(retrans):
+    offset, fmt = nettput.TCP_INFO_RETRANS
+    info = bytearray(232)
+    struct.pack_into(fmt, info, offset, retrans)
+
+    return bytes(info)
+
+
+class BadServer(object):
+    """
+    Server acknowledging a fixed reply to every stream.
+    """
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.sock = socket.socket()
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(8)
+        self.port = self.sock.getsockname()[1]
+        t = threading.Thread(target=self.serve)
+        t.daemon = True
+        t.start()
+
+    def serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            with conn:
+                while conn.recv(65536):
+                    pass
+                conn.sendall(self.reply)
+
+    def close(self):
+        self.sock.close()
+
+
+@unittest.skipIf(getattr(socket, "TCP_INFO", None) is None,
+                 "TCP_INFO is not supported")
+class TestRetransmits(unittest.TestCase):
+
+    def test_retransmits(self):
+        self.assertEqual(nettput.retransmits(FakeSocket(tcp_info(7))), 7)
+
+    def test_empty(self):
+        self.assertIsNone(nettput.retransmits(FakeSocket(b"")))
+
+    def test_truncated(self):
+        offset, _ = nettput.TCP_INFO_RETRANS
+        sock = FakeSocket(tcp_info(7)[:offset + 2])
+        self.assertIsNone(nettput.retransmits(sock))
+
+    def test_unsupported(self):
+        sock = FakeSocket(error=OSError("Protocol not available"))
+        self.assertIsNone(nettput.retransmits(sock))
+
+
+class TestMeasure(unittest.TestCase):
+
+    def test_measure(self):
+        server = nettput.Server(("127.0.0.1", 0), buf=65536)
+        server.start()
+        try:
+            r = nettput.measure("127.0.0.1", port=server.server_address[1],
+                                streams=2, duration=0.2, buf=65536)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(len(r["streams"]), 2)
+        self.assertEqual(r["bytes"], sum(s["bytes"] for s in r["streams"]))
+        self.assertEqual(r["bytes"] % 65536, 0)
+        self.assertGreater(r["gbps"], 0)
+        self.assertEqual([s["stream"] for s in r["streams"]], [0, 1])
+
+    def test_no_acknowledgement(self):
+        server = BadServer(b"")
+        try:
+            with self.assertRaisesRegex(RuntimeError, "closed"):
+                nettput.measure("127.0.0.1", port=server.port, streams=1,
+                                duration=0.1, buf=65536)
+        finally:
+            server.close()
+
+    def test_wrong_count(self):
+        server = BadServer(nettput.ACK.pack(1))
+        try:
+            with self.assertRaisesRegex(RuntimeError, "received 1$"):
+                nettput.measure("127.0.0.1", port=server.port, streams=1,
+                                duration=0.1, buf=65536)
+        finally:
+            server.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
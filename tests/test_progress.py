@@ -0,0 +1,134 @@
+"""
+test_progress.py
+
+Progress status line under the queued logging of lib.logs.
+
+Copyright (c) 2016  Nexenta Systems
+William Kettler <william.kettler@nexenta.com>
+"""
+
+import os
+import re
+import pty
+import sys
+import logging
+import tempfile
+import unittest
+import lib.logs as logs
+import lib.progress as progress
+
+
+CONFIG = """
+[loggers]
+keys=root,progress
+
+[logger_progress]
+level=DEBUG
+handlers=
+qualname=lib.progress
+
+[handlers]
+keys=console
+
+[formatters]
+keys=console
+
+[logger_root]
+level=DEBUG
+handlers=console
+
+[handler_console]
+class=StreamHandler
+level=INFO
+formatter=console
+args=(sys.stdout,)
+
+[formatter_console]
+format=%(message)s
+"""
+
+
+class TestProgress(unittest.TestCase):
+
+    def setUp(self):
+        self.master, slave = pty.openpty()
+        self.tty = os.fdopen(slave, "w")
+        self.stdout = sys.stdout
+        fd, self.config = tempfile.mkstemp()
+        with os.fdopen(fd, "w") as fh:
+            fh.write(CONFIG)
+
+        # The console handler writes to the terminal
+        sys.stdout = self.tty
+        logs.setup(self.config)
+
+    def tearDown(self):
+        logs.shutdown()
+        sys.stdout = self.stdout
+        logging.getLogger().handlers = []
+        self.tty.close()
+        os.close(self.master)
+        os.remove(self.config)
+
+    def read(self):
+        output = b""
+        while True:
+            try:
+                chunk = os.read(self.master, 65536)
+            except OSError:
+                break
+            output += chunk
+            if b"end" in output:
+                break
+
+        return output.decode()
+
+    def test_status_line_cleared_before_records(self):
+        p = progress.Progress("Disk", total=3, interval=0)
+        self.assertTrue(p.tty)
+
+        p.advance(rate=100.0)
+        logging.getLogger().info("hello")
+        p.advance(rate=100.0)
+        p.close()
+        logs.shutdown()
+        self.tty.write("end\n")
+        self.tty.flush()
+
+        output = self.read()
+        # The status line is drawn on the console handler's terminal
+        draws = list(re.finditer(r"\rDisk: [^\r\x1b]*\x1b\[K", output))
+        self.assertEqual(len(draws), 2)
+        self.assertIn("1/3 items, 100.0 MB/s", draws[0].group(0))
+        # and is replaced or cleared before anything else is written, the
+        # record is written by the listener so it may come after either draw
+        for d in draws:
+            rest = output[d.end():]
+            self.assertTrue(rest.startswith("\rDisk: ") or
+                            rest.startswith("\r\x1b[K"), repr(rest))
+        text = re.sub(r"\rDisk: [^\r\x1b]*\x1b\[K|\r\x1b\[K", "", output)
+        self.assertEqual(text, "hello\r\nend\r\n")
+
+    def test_log_records_without_terminal(self):
+        logs.shutdown()
+        with tempfile.TemporaryFile("w+") as fh:
+            sys.stdout = fh
+            logs.setup(self.config)
+
+            p = progress.Progress("Disk", total=3, interval=0)
+            self.assertFalse(p.tty)
+            p.advance(rate=100.0)
+            p.close()
+            logs.shutdown()
+
+            fh.seek(0)
+            output = fh.read()
+
+        # One record per report and no status line
+        self.assertTrue(output.startswith("Disk: 1/3 items, 100.0 MB/s, "))
+        self.assertEqual(output.count("\n"), 1)
+        self.assertNotIn("\r", output)
+
+
+if __name__ == "__main__":
+    unittest.main()
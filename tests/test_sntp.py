@@ -0,0 +1,161 @@
+"""
+test_sntp.py
+
+SNTP client of lib.sntp.
+
+Copyright (c) 2016  Nexenta Systems
+William Kettler <william.kettler@nexenta.com>
+"""
+
+import socket
+import threading
+import unittest
+import lib.sntp as sntp
+
+
+def reply(tx, skew=0.0, li=0, mode=sntp.SERVER, stratum=2, originate=None):
+    """
+    Return a server reply to the request with transmit timestamp tx.
+    """
+    t = sntp.to_ntp(sntp.from_ntp(tx) + skew)
+    if originate is None:
+        originate = tx
+
+    return sntp.PACKET.pack((li << 6) | (4 << 3) | mode, stratum, 0, 0, 0,
+                            0, 0, 0, originate, t, t)
+
+
+class FakeSocket(object):
+    """
+    UDP socket answering each request with the captured replies returned by
+    a function of the request's transmit timestamp.
+    """
+
+    def __init__(self, replies):
+        self.replies = replies
+        self.pending = []
+
+    def sendto(self, data, address):
+        tx = sntp.PACKET.unpack_from(data)[10]
+        self.pending = list(self.replies(tx))
+
+    def settimeout(self, timeout):
+        pass
+
+    def recvfrom(self, size):
+        if not self.pending:
+            raise socket.timeout("timed out")
+        return self.pending.pop(0), ("127.0.0.1", 123)
+
+
+class Server(object):
+    """
+    Local SNTP server with a skewed clock which drops some requests.
+    """
+
+    def __init__(self, skew, drop=()):
+        self.skew = skew
+        self.drop = drop
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.port = self.sock.getsockname()[1]
+        t = threading.Thread(target=self.serve)
+        t.daemon = True
+        t.start()
+
+    def serve(self):
+        n = 0
+        while True:
+            try:
+                data, address = self.sock.recvfrom(512)
+            except OSError:
+                return
+            n += 1
+            if n in self.drop:
+                continue
+            tx = sntp.PACKET.unpack_from(data)[10]
+            self.sock.sendto(reply(tx, skew=self.skew), address)
+
+    def close(self):
+        self.sock.close()
+
+
+class TestTimestamps(unittest.TestCase):
+
+    def test_round_trip(self):
+        t = 1476800000.25
+        self.assertEqual(sntp.to_ntp(t) >> 32, int(t) + sntp.EPOCH)
+        self.assertAlmostEqual(sntp.from_ntp(sntp.to_ntp(t)), t, places=6)
+
+    def test_epoch(self):
+        self.assertEqual(sntp.from_ntp(0), -sntp.EPOCH)
+
+
+class TestQuery(unittest.TestCase):
+
+    def query(self, replies):
+        return sntp.query(FakeSocket(replies), ("127.0.0.1", 123),
+                          timeout=1)
+
+    def test_offset(self):
+        r = self.query(lambda tx: [reply(tx, skew=5.0)])
+        self.assertAlmostEqual(r["offset"], 5.0, places=2)
+        self.assertGreaterEqual(r["delay"], 0)
+        self.assertEqual(r["stratum"], 2)
+
+    def test_no_reply(self):
+        with self.assertRaises(socket.timeout):
+            self.query(lambda tx: [])
+
+    def test_ignores_short_and_late_replies(self):
+        r = self.query(lambda tx: [b"", b"\x24" * 20,
+                                   reply(tx, skew=9.0, originate=tx - 1),
+                                   reply(tx, skew=-3.0)])
+        self.assertAlmostEqual(r["offset"], -3.0, places=2)
+
+    def test_only_malformed_replies(self):
+        with self.assertRaises(socket.timeout):
+            self.query(lambda tx: [b"\x00" * (sntp.PACKET.size - 1)])
+
+    def test_unsynchronized(self):
+        with self.assertRaisesRegex(RuntimeError, "not synchronized"):
+            self.query(lambda tx: [reply(tx, li=sntp.ALARM)])
+        with self.assertRaisesRegex(RuntimeError, "not synchronized"):
+            self.query(lambda tx: [reply(tx, stratum=0)])
+
+    def test_wrong_mode(self):
+        with self.assertRaisesRegex(RuntimeError, "mode 3"):
+            self.query(lambda tx: [reply(tx, mode=3)])
+
+
+class TestSample(unittest.TestCase):
+
+    def test_sample(self):
+        server = Server(2.5, drop=(2,))
+        try:
+            r = sntp.sample("127.0.0.1", samples=3, port=server.port,
+                            timeout=0.2, interval=0)
+        finally:
+            server.close()
+
+        self.assertEqual(r["server"], "127.0.0.1")
+        self.assertAlmostEqual(r["offset"], 2.5, places=2)
+        self.assertEqual(r["samples"], 2)
+        self.assertEqual(r["lost"], 1)
+        self.assertLess(r["jitter"], 0.1)
+
+    def test_no_valid_response(self):
+        server = Server(0.0, drop=(1, 2))
+        try:
+            results = sntp.sample_all(["127.0.0.1"], samples=2,
+                                      port=server.port, timeout=0.1,
+                                      interval=0)
+        finally:
+            server.close()
+
+        self.assertIsInstance(results["127.0.0.1"], RuntimeError)
+        self.assertIn("No valid response", str(results["127.0.0.1"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+"""
+test_zpoolstat.py
+
+Scrub and resilver status parser of lib.zpoolstat.
+
+Copyright (c) 2016  Nexenta Systems
+William Kettler <william.kettler@nexenta.com>
+"""
+
+import unittest
+import lib.zpoolstat as zpoolstat
+
+
+STATUS = """  pool: rpool
+ state: ONLINE
+  scan: scrub repaired 0 in 0h1m with 0 errors on Sun Jan  1 00:00:00 2017
+config:
+
+\tNAME        STATE     READ WRITE CKSUM
+\trpool       ONLINE       0     0     0
+\t  c0t0d0s0  ONLINE       0     0     0
+
+errors: No known data errors
+
+  pool: tank
+ state: DEGRADED
+status: One or more devices is currently being resilvered.
+action: Wait for the resilver to complete.
+  scan: resilver in progress since Mon Jan  2 00:00:00 2017
+        100G scanned out of 4.00T at 10M/s, 90h to go
+        10G resilvered, 2.50% done
+config:
+
+\tNAME          STATE     READ WRITE CKSUM
+\ttank          DEGRADED     0     0     0
+\t  mirror-0    DEGRADED     0     0     0
+\t    c1t0d0    ONLINE       0     0     0
+\t    c1t1d0    DEGRADED     0     0     0  (resilvering)
+
+errors: No known data errors
+
+  pool: new
+ state: ONLINE
+  scan: scrub in progress since Sun Jul 25 16:07:49 2021
+\t1.37T scanned at 100M/s, 1.00T issued at 80M/s, 4.56T total
+\t0B repaired, 21.93% done, 12:03:21 to go
+config:
+
+  pool: paused
+ state: ONLINE
+  scan: scrub paused since Sun Jul 25 16:07:49 2021
+\tscrub started on Sun Jul 25 12:00:00 2021
+\t2.00T scanned, 512G issued, 4.56T total
+\t0B repaired, 10.96% done
+config:
+
+  pool: idle
+ state: ONLINE
+  scan: none requested
+config:
+"""
+
+
+def scans(text):
+    return dict((s["pool"], s)
+                for s in zpoolstat.parse_scan(text.splitlines(True)))
+
+
+class TestParseScan(unittest.TestCase):
+
+    def test_completed(self):
+        s = scans(STATUS)["rpool"]
+        self.assertEqual(s["function"], "scrub")
+        self.assertEqual(s["state"], "completed")
+        self.assertIsNone(s["examined"])
+        self.assertIsNone(s["percent"])
+
+    def test_resilver_scanned_out_of(self):
+        s = scans(STATUS)["tank"]
+        self.assertEqual(s["function"], "resilver")
+        self.assertEqual(s["state"], "in progress")
+        self.assertEqual(s["examined"], 100 * 1024 ** 3)
+        self.assertEqual(s["total"], 4 * 1024 ** 4)
+        self.assertEqual(s["percent"], 2.5)
+
+    def test_scrub_issued(self):
+        s = scans(STATUS)["new"]
+        self.assertEqual(s["function"], "scrub")
+        self.assertEqual(s["state"], "in progress")
+        self.assertEqual(s["examined"], 1024 ** 4)
+        self.assertAlmostEqual(s["total"], 4.56 * 1024 ** 4)
+        self.assertEqual(s["percent"], 21.93)
+
+    def test_paused(self):
+        s = scans(STATUS)["paused"]
+        self.assertEqual(s["state"], "paused")
+        self.assertEqual(s["percent"], 10.96)
+
+    def test_none(self):
+        s = scans(STATUS)["idle"]
+        self.assertIsNone(s["function"])
+        self.assertEqual(s["state"], "none")
+
+    def test_order(self):
+        pools = [s["pool"] for s in
+                 zpoolstat.parse_scan(STATUS.splitlines(True))]
+        self.assertEqual(pools, ["rpool", "tank", "new", "paused", "idle"])
+
+    def test_empty(self):
+        self.assertEqual(list(zpoolstat.parse_scan([])), [])
+        self.assertEqual(list(zpoolstat.parse_scan(["\n"])), [])
+
+    def test_no_scan_line(self):
+        s = scans("  pool: tank\n state: ONLINE\nconfig:\n")["tank"]
+        self.assertEqual(s["state"], "none")
+
+    def test_malformed_progress(self):
+        text = ("  pool: tank\n"
+                "  scan: resilver in progress since Mon Jan  2 2017\n"
+                "        garbage scanned out of nothing\n"
+                "        ??% done\n")
+        s = scans(text)["tank"]
+        self.assertEqual(s["function"], "resilver")
+        self.assertEqual(s["state"], "in progress")
+        self.assertIsNone(s["examined"])
+        self.assertIsNone(s["total"])
+        self.assertIsNone(s["percent"])
+
+    def test_truncated(self):
+        # Output cut off after the scan header
+        text = STATUS[:STATUS.index("        100G")]
+        s = scans(text)["tank"]
+        self.assertEqual(s["state"], "in progress")
+        self.assertIsNone(s["examined"])
+
+
+class TestParseSize(unittest.TestCase):
+
+    def test_sizes(self):
+        self.assertEqual(zpoolstat.parse_size("0"), 0)
+        self.assertEqual(zpoolstat.parse_size("512B"), 512)
+        self.assertEqual(zpoolstat.parse_size("1.5K"), 1536)
+        self.assertEqual(zpoolstat.parse_size("2T"), 2 * 1024 ** 4)
+        self.assertIsNone(zpoolstat.parse_size("-"))
+
+    def test_malformed(self):
+        self.assertRaises(ValueError, zpoolstat.parse_size, "abc1")
+
+
+if __name__ == "__main__":
+    unittest.main()